@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""Benchmarks for fancyio's rendering and input paths.
+
+Runs each scenario against a fake terminal, so no tty is needed, and reports the wall time, the number of bytes and write calls sent to the terminal, the number of redraws per second, and the number of lines drawn, as collected by fancyio.RenderStats.
+
+Usage: python benchmark.py [--scale SCALE] [--mode MODE] [--json] [--compare FILE] [SCENARIO...]
+"""
+
+import sys
+
+import argparse
+import json
+import platform
+import time
+
+import fancyio
+
+class _Formatting(str):
+    """A formatting escape sequence which can be called with text, like those of blessings.
+    """
+    def __call__(self, text):
+        return self + text + FakeTerminal.normal
+
+class FakeTerminal:
+    """A stand-in for blessings.Terminal with a fixed size and xterm escape sequences.
+    """
+    clear_eol = '\x1b[K'
+    clear_eos = '\x1b[J'
+    move_up = '\x1b[A'
+    normal = '\x1b[m'
+    styles = {
+        'bold': '\x1b[1m',
+        'black_on_cyan': '\x1b[30m\x1b[46m',
+        'green': '\x1b[32m',
+        'red': '\x1b[31m',
+        'yellow': '\x1b[33m'
+    }
+
+    def __init__(self, width=80, height=24):
+        self.width = width
+        self.height = height
+
+    def __getattr__(self, name):
+        return _Formatting(self.styles.get(name, '\x1b[7m'))
+
+    def move_x(self, x):
+        return '\x1b[{}G'.format(x + 1)
+
+class CountingStream:
+    """An output stream which discards everything written to it, but counts the writes and bytes.
+    """
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return True
+
+    def write(self, text):
+        self.writes += 1
+        self.bytes += len(text.encode('utf-8'))
+        return len(text)
+
+def _keys(*chunks):
+    """Decode the chunks of raw input like IO.read_keys would, one chunk per read.
+    """
+    decoder = fancyio._KeyDecoder()
+    for chunk in chunks:
+        keys = decoder.feed(chunk.encode('utf-8')) + decoder.flush()
+        if len(keys) > 0:
+            yield keys
+
+def bench_print(io, scale):
+    for i in range(int(5000 * scale)):
+        io.print('line', i)
+
+def bench_do(io, scale):
+    lines = [io.do(time.sleep, args=[0.05], message='task {}'.format(i), block=False) for i in range(int(300 * scale))]
+    for line in lines:
+        line.join()
+
+def bench_sleep(io, scale):
+    lines = [fancyio.SleepLine(io, 0.2) for _ in range(int(100 * scale))]
+    for line in lines:
+        line.start()
+    for line in lines:
+        line.join()
+
+def bench_paste(io, scale):
+    payload = '{"token": "' + 'x' * int(100000 * scale) + '"}'
+    raw = '\x1b[200~' + payload + '\x1b[201~\r'
+    io._keys = _keys(*(raw[i:i + 4096] for i in range(0, len(raw), 4096)))
+    answer = io.input('token: ')
+    assert answer == payload
+
+def bench_typing(io, scale):
+    text = 'the quick brown fox jumps over the lazy dog ' * int(50 * scale)
+    io._keys = _keys(*text, '\r')
+    answer = io.input('type: ')
+    assert answer == text
+
+SCENARIOS = {
+    'print': bench_print,
+    'do': bench_do,
+    'sleep': bench_sleep,
+    'paste': bench_paste,
+    'typing': bench_typing
+}
+
+def run(name, scale=1.0, width=80, height=24, mode='terminal'):
+    """Run the scenario and return its results as a dict.
+    """
+    stream = CountingStream()
+    stats = fancyio.RenderStats()
+    io = fancyio.IO(FakeTerminal(width, height), stream=stream, stats=stats, mode=mode)
+    start = time.perf_counter()
+    SCENARIOS[name](io, scale)
+    io._close()
+    wall_time = time.perf_counter() - start
+    return {
+        'wall_time': wall_time,
+        'bytes': stream.bytes,
+        'writes': stream.writes,
+        'updates': stats.updates,
+        'updates_per_second': stats.updates / wall_time,
+        'lines_drawn': stats.lines_drawn,
+        'lock_held': stats.lock_held
+    }
+
+def compare(results, baseline, tolerance):
+    """Returns a list of descriptions of the metrics which are worse than in the baseline by more than the tolerance.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in ('wall_time', 'bytes', 'writes'):
+            old = baseline[name][metric]
+            if result[metric] > old * (1 + tolerance):
+                regressions.append('{} {}: {:.4g} -> {:.4g}'.format(name, metric, old, result[metric]))
+    return regressions
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark fancyio against a fake terminal.')
+    parser.add_argument('scenarios', nargs='*', metavar='SCENARIO', help='scenarios to run, out of {} (default: all)'.format(', '.join(SCENARIOS)))
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the size of each scenario by this factor')
+    parser.add_argument('--mode', choices=['terminal', 'stream', 'json'], default='terminal', help='output mode of the IO (default: terminal)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='compare against results previously saved with --json, exit with status 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='relative slowdown allowed by --compare (default: 0.25)')
+    args = parser.parse_args(args)
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario: {}'.format(name))
+    results = {name: run(name, scale=args.scale, mode=args.mode) for name in (args.scenarios or SCENARIOS)}
+    if args.json:
+        json.dump({
+            'fancyio': fancyio.__version__,
+            'python': platform.python_version(),
+            'scale': args.scale,
+            'mode': args.mode,
+            'results': results
+        }, sys.stdout, indent=4, sort_keys=True)
+        print()
+    else:
+        print('{:<8} {:>10} {:>12} {:>8} {:>8} {:>10} {:>8}'.format('scenario', 'wall time', 'bytes', 'writes', 'updates', 'updates/s', 'lines'))
+        for name, result in results.items():
+            print('{:<8} {:>9.3f}s {:>12} {:>8} {:>8} {:>10.1f} {:>8}'.format(name, result['wall_time'], result['bytes'], result['writes'], result['updates'], result['updates_per_second'], result['lines_drawn']))
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('regression: ' + regression, file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
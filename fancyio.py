@@ -1,42 +1,349 @@
 import sys
 
+import array
+import asyncio
+import atexit
+import codecs
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
 import datetime
+import functools
+import heapq
+import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import select
+import selectors
+import signal
+import socket
 import termios
 import threading
 import time
 import tty
+import unicodedata
+import weakref
 
 __version__ = '0.5.0'
 
-def _getch():
+_missing = object()
+
+_ESCAPE_TIMEOUT = 0.05 # seconds to wait for the rest of an escape sequence before treating the escape key as pressed on its own
+
+_FORMATTING = re.compile(r'\x1b(?:\[[0-9;:]*m|[()][0-9A-Za-z])') # SGR and character set escape sequences, which change how the following text looks
+_PASTED_CONTROL = re.compile(r'\r\n|[\x00-\x1f\x7f-\x9f]') # line breaks, tabs and other control characters in pasted text, which are replaced with spaces
+_ESCAPE_SEQUENCE = re.compile(r'\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[ -/]*[0-~])') # CSI, OSC and other escape sequences, which take up no space on screen
+
+class _Paste(str):
+    """Text which was pasted using bracketed paste, as opposed to typed.
+    """
+    pass
+
+class _KeyDecoder:
+    """Splits raw terminal input into key events: single characters, complete escape sequences, and pasted text (as _Paste).
+    """
+    def __init__(self, encoding='utf-8'):
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self._sequence = '' # incomplete escape sequence
+        self._paste = None # list of pasted chunks while a bracketed paste is in progress
+        self._paste_tail = '' # the last few pasted characters, to find an end marker which is split across reads
+
+    @property
+    def pending(self):
+        """Whether an incomplete escape sequence is waiting for more input.
+        """
+        return self._paste is None and len(self._sequence) > 0
+
+    def feed(self, data):
+        """Decode the bytes and return a list of the key events they complete.
+        """
+        text = self._sequence + self._decoder.decode(data)
+        self._sequence = ''
+        keys = []
+        i = 0
+        while i < len(text):
+            if self._paste is not None:
+                rest = text[i:]
+                end = (self._paste_tail + rest).find('\x1b[201~')
+                if end == -1:
+                    self._paste.append(rest)
+                    self._paste_tail = (self._paste_tail + rest)[-5:]
+                    break
+                end -= len(self._paste_tail) # position of the end marker in rest, may be negative
+                pasted = ''.join(self._paste) + rest
+                keys.append(_Paste(pasted[:len(pasted) - len(rest) + end]))
+                self._paste = None
+                i += end + 6
+            elif text[i] != '\x1b':
+                keys.append(text[i])
+                i += 1
+            elif i + 1 >= len(text):
+                self._sequence = text[i:]
+                break
+            elif text[i + 1] == '[': # CSI sequence
+                end = i + 2
+                while end < len(text) and '\x20' <= text[end] <= '\x3f':
+                    end += 1
+                if end >= len(text):
+                    self._sequence = text[i:]
+                    break
+                sequence = text[i:end + 1]
+                if sequence == '\x1b[200~': # start of bracketed paste
+                    self._paste = []
+                    self._paste_tail = ''
+                else:
+                    keys.append(sequence)
+                i = end + 1
+            elif text[i + 1] == 'O': # SS3 sequence
+                if i + 2 >= len(text):
+                    self._sequence = text[i:]
+                    break
+                keys.append(text[i:i + 3])
+                i += 3
+            else: # alt + key
+                keys.append(text[i:i + 2])
+                i += 2
+        return keys
+
+    def flush(self):
+        """Returns the incomplete escape sequence as a key event of its own, if there is one.
+        """
+        if not self.pending:
+            return []
+        sequence, self._sequence = self._sequence, ''
+        return [sequence]
+
+def _read_keys():
+    """Reads all input which is available on stdin at once, and yields it as lists of key events.
+    """
     fd = sys.stdin.fileno()
-    old_settings = termios.tcgetattr(fd)
+    old_settings = termios.tcgetattr(fd) if os.isatty(fd) else None # input may be piped in
+    decoder = _KeyDecoder(sys.stdin.encoding or 'utf-8')
     try:
-        tty.setraw(fd)
+        if old_settings is not None:
+            tty.setraw(fd)
         while True:
-            yield sys.stdin.read(1)
+            select.select([fd], [], [])
+            data = os.read(fd, 4096)
+            if len(data) == 0: # end of file
+                yield ['\x04']
+                continue
+            keys = decoder.feed(data)
+            while decoder.pending and select.select([fd], [], [], _ESCAPE_TIMEOUT)[0]:
+                keys += decoder.feed(os.read(fd, 4096))
+            keys += decoder.flush()
+            if len(keys) > 0:
+                yield keys
     finally:
-        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+        if old_settings is not None:
+            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+
+_rendering = weakref.WeakSet() # IOs which have started a renderer thread, see _flush_at_exit
+
+@atexit.register
+def _flush_at_exit():
+    """Draws the changes which have not been drawn yet, since renderer threads are daemon threads, which don't get to finish when the program exits.
+    """
+    for io in list(_rendering):
+        if io._renderer is not None:
+            io._stop_renderer()
+            io.update()
+
+_render_caching = {} # maps line classes to whether their render output can be cached, see _caches_render
+
+def _caches_render(cls):
+    """Returns whether the render_key of the line class accounts for its render method, i.e. whether render_key is overridden at least as far down the class hierarchy as render.
+    """
+    if cls not in _render_caching:
+        for base in cls.__mro__:
+            if 'render_key' in vars(base):
+                _render_caching[cls] = True
+                break
+            if 'render' in vars(base) or 'render_rows' in vars(base):
+                _render_caching[cls] = False
+                break
+        else:
+            _render_caching[cls] = False
+    return _render_caching[cls]
+
+_row_drawing = {} # maps line classes to whether their draw method takes the row to draw, see _draws_rows
+
+def _draws_rows(cls):
+    """Returns whether the draw method of the line class takes the row to draw. Subclasses which override draw without it draw a single row.
+    """
+    if cls not in _row_drawing:
+        try:
+            inspect.signature(cls.draw).bind(None, 0)
+        except TypeError:
+            _row_drawing[cls] = False
+        else:
+            _row_drawing[cls] = True
+    return _row_drawing[cls]
+
+def _simple(text):
+    """Returns whether each character of the text takes up exactly one column, so that it can be measured using len.
+    """
+    return text.isascii() and text.isprintable()
+
+def _char_width(char):
+    if unicodedata.category(char) in ('Cc', 'Cf', 'Me', 'Mn'):
+        return 0 # control, format and combining characters
+    return 2 if unicodedata.east_asian_width(char) in ('F', 'W') else 1
+
+def _chunks(text):
+    """Yields the escape sequences and characters of the text, along with the number of columns each of them takes up.
+    """
+    position = 0
+    while position < len(text):
+        if text[position] == '\x1b':
+            match = _ESCAPE_SEQUENCE.match(text, position)
+            if match is not None:
+                yield match.group(), 0
+                position = match.end()
+                continue
+        yield text[position], _char_width(text[position])
+        position += 1
+
+@functools.lru_cache(maxsize=1024)
+def _complex_width(text):
+    return sum(width for chunk, width in _chunks(text))
+
+def _width(text):
+    """Returns the number of columns the text takes up on screen. Escape sequences take up no columns, and wide characters such as CJK and most emoji take up two.
+    """
+    if _simple(text):
+        return len(text)
+    return _complex_width(text)
+
+def _head(text, width):
+    """Returns the longest start of the text which fits into the given number of columns. If a wide character had to be cut in half, a space takes its place.
+    """
+    if width <= 0:
+        return ''
+    if _simple(text):
+        return text[:width]
+    result = []
+    used = 0
+    for chunk, chunk_width in _chunks(text):
+        if used + chunk_width > width:
+            return ''.join(result) + ' ' * (width - used)
+        result.append(chunk)
+        used += chunk_width
+    return ''.join(result)
+
+def _skip(text, width):
+    """Returns the text without the given number of columns at its start. If a wide character had to be cut in half, a space takes its place.
+    """
+    if width <= 0:
+        return text
+    if _simple(text):
+        return text[width:]
+    used = 0
+    position = 0
+    for chunk, chunk_width in _chunks(text):
+        if used >= width and chunk_width > 0:
+            return text[position:]
+        position += len(chunk)
+        used += chunk_width
+        if used > width:
+            return ' ' * (used - width) + text[position:]
+    return ''
+
+def _tail(text, width):
+    """Returns the longest end of the text which fits into the given number of columns. If a wide character had to be cut in half, a space takes its place.
+    """
+    if width <= 0:
+        return ''
+    if _simple(text):
+        return text[-width:]
+    chunks = list(_chunks(text))
+    used = 0
+    for index in reversed(range(len(chunks))):
+        chunk, chunk_width = chunks[index]
+        if used + chunk_width > width:
+            return ' ' * (width - used) + ''.join(chunk for chunk, chunk_width in chunks[index + 1:])
+        used += chunk_width
+    return text
+
+@functools.lru_cache(maxsize=1024)
+def _layout(text, width):
+    """Splits the text into rows of at most width columns, which must be at least 2. Returns a tuple of pairs of each row and the number of columns it takes up.
+
+    Escape sequences are kept in the row where they occur. Formatting which is still active at the end of a row is reset there and repeated at the start of the next row, so that each row can be drawn on its own. Layouts are cached, so that redrawing unchanged lines doesn't measure them again.
+    """
+    if _simple(text):
+        return tuple((text[start:start + width], min(width, len(text) - start)) for start in range(0, max(len(text), 1), width))
+    rows = []
+    row = []
+    used = 0
+    formatting = ''
+    for chunk, chunk_width in _chunks(text):
+        if used + chunk_width > width:
+            rows.append((''.join(row) + ('\x1b[m' if formatting else ''), used))
+            row = [formatting]
+            used = 0
+        if _FORMATTING.fullmatch(chunk):
+            formatting = '' if chunk in ('\x1b[m', '\x1b[0m') else formatting + chunk
+        row.append(chunk)
+        used += chunk_width
+    rows.append((''.join(row), used))
+    return tuple(rows)
+
+def _progress_bar(progress):
+    fifths = min(int(progress * 5), 4)
+    return '=' * fifths + '.' * (4 - fifths)
 
 class Line:
     """An empty line. Base class for other types of line.
     """
     def __init__(self, io):
+        self.dirty = True
         self.io = io
         if self.io is not None:
             self.io.append(self)
 
+    def __setattr__(self, name, value):
+        """Mark the line as dirty whenever a public attribute changes, so that IO.update redraws it.
+        """
+        changed = name not in ('dirty', 'io') and not name.startswith('_') and self.__dict__.get(name, _missing) != value
+        super().__setattr__(name, value)
+        if changed: # only after the value is stored, so that the renderer can't draw the old value and mark the line as clean
+            self.changed()
+
+    def __str__(self):
+        """Returns the line's content as plain text, without formatting.
+        """
+        return ''
+
     def activate(self):
         """Pass control to the line. By default, lines return immediately. Subclasses may read input or do other things instead.
         """
         pass
 
-    def draw(self):
-        """Draw the line's content into the line where the cursor is currently positioned.
+    def changed(self):
+        """Mark the line as dirty and notify the IO that it needs to be redrawn.
+
+        This happens automatically when a public attribute is assigned, so it only needs to be called for other changes.
+        """
+        self.__dict__['dirty'] = True
+        if self.__dict__.get('io') is not None:
+            self.io._line_changed(self)
+
+    async def activate_async(self):
+        """Like activate, but for lines of an AsyncIO. By default, this calls activate.
+        """
+        self.activate()
+
+    def draw(self, row=0):
+        """Draw the given row of the line's content into the row where the cursor is currently positioned.
         """
         if self.io is None:
             return
-        print(self.io.terminal.move_x(0) + self.io.terminal.clear_eol, end='', flush=True)
+        self.io.write(self.layout()[row])
 
     def is_interactive(self):
         """Returns a boolean representing whether or not this line has an interactive mode.
@@ -45,26 +352,90 @@ class Line:
         """
         return False
 
+    def is_running(self):
+        """Returns a boolean representing whether or not the line may still change on its own.
+
+        Lines which are not running and not interactive may be compacted into the IO's history once they scroll out of screen.
+        """
+        return False
+
+    def layout(self):
+        """Returns the output of render_rows.
+
+        It is reused as long as render_key returns the same value and the terminal has not changed.
+        """
+        if _caches_render(type(self)):
+            key = (self.io, self.io._caps_version, self.render_key())
+            if self.__dict__.get('_rendered', (None, None))[0] != key:
+                self._rendered = (key, self.render_rows())
+            return self._rendered[1]
+        return self.render_rows()
+
+    def render(self):
+        """Returns the text and escape sequences which draw the line's content into the line where the cursor is currently positioned.
+
+        Subclasses should override this rather than draw, so that the output can be composed into a single frame.
+        """
+        return self.io.move_x(0) + self.io.caps['clear_eol']
+
+    def render_rows(self):
+        """Returns a list of the text and escape sequences which draw each row the line takes up. By default, a line takes up the single row drawn by render.
+
+        Subclasses may override this to wrap their content across multiple rows.
+        """
+        return [self.render()]
+
+    def render_key(self):
+        """Returns a hashable value which changes whenever the output of render would change, apart from changes to the terminal.
+
+        Subclasses which override render should also override this, otherwise their output is not cached.
+        """
+        return ()
+
+    def stream_event(self):
+        """Returns the name of the event to record for the line's current state when the IO is in a streaming mode, or None if there is nothing to record yet.
+
+        The line is written to the stream whenever this changes. By default, lines are written once, as soon as they are neither running nor interactive.
+        """
+        if self.is_running() or self.is_interactive():
+            return None
+        return 'line'
+
 class StringLine(Line):
     """A line of formatted text.
+
+    The message may contain escape sequences and wide characters. If it doesn't fit on screen, it is cut off, or wrapped across multiple rows if wrap is true.
     """
-    def __init__(self, io, message=''):
+    def __init__(self, io, message='', wrap=False):
         self.message = message
+        self.wrap = wrap
         super().__init__(io)
 
-    def draw(self):
-        if self.io is None:
-            return
-        print(self.io.terminal.move_x(0), end='', flush=True)
-        if len(self.message) > self.io.terminal.width:
-            print(self.message[:self.io.terminal.width - 3], end=self.io.terminal.black_on_cyan('...'), flush=True)
-        elif len(self.message) == self.io.terminal.width:
-            print(self.message, end='', flush=True)
+    def __str__(self):
+        return self.message
+
+    def render(self):
+        width = _width(self.message)
+        if width > self.io.width:
+            return self.io.move_x(0) + _head(self.message, self.io.width - 3) + self.io.ellipsis
+        elif width == self.io.width:
+            return self.io.move_x(0) + self.message
         else:
-            print(self.message + self.io.terminal.clear_eol, end='', flush=True)
+            return self.io.move_x(0) + self.message + self.io.caps['clear_eol']
+
+    def render_rows(self):
+        if self.wrap and self.io.width >= 2 and _width(self.message) > self.io.width:
+            return [
+                self.io.move_x(0) + row + (self.io.caps['clear_eol'] if row_width < self.io.width else '')
+                for row, row_width in _layout(self.message, self.io.width)
+            ]
+        return [self.render()]
+
+    def render_key(self):
+        return (self.message, self.wrap)
 
 class PrefixLine(StringLine):
-    def __init__(self, io, message='', prefix='**', prefix_color=None):
+    def __init__(self, io, message='', prefix='**', prefix_color=None, wrap=False):
         if len(prefix) == 0:
             self.prefix = '    '
         elif len(prefix) == 1:
@@ -76,137 +447,367 @@ class PrefixLine(StringLine):
         else:
             self.prefix = prefix
         self.prefix_color = prefix_color
-        super().__init__(io, message=message)
-
-    def draw(self):
-        if self.io.terminal.width < 3:
-            print(self.io.terminal.move_x(0) + self.io.terminal.clear_eol, end='', flush=True)
-        elif self.io.terminal.width < 10:
-            print(self.io.terminal.move_x(0) + self.message[:self.io.terminal.width - 3], end=self.io.terminal.black_on_cyan('...'), flush=True)
-        elif len(self.message) + 7 > self.io.terminal.width:
-            print(self.io.terminal.move_x(0) + self.formatted_prefix() + self.message[:self.io.terminal.width - 10], end=self.io.terminal.black_on_cyan('...'), flush=True)
-        elif len(self.message) + 7 == self.io.terminal.width:
-            print(self.io.terminal.move_x(0) + self.formatted_prefix() + self.message, end='', flush=True)
+        super().__init__(io, message=message, wrap=wrap)
+
+    def __str__(self):
+        return '[' + self.prefix[:4] + '] ' + self.message
+
+    def render(self):
+        width = _width(self.message)
+        if self.io.width < 3:
+            return self.io.move_x(0) + self.io.caps['clear_eol']
+        elif self.io.width < 10:
+            return self.io.move_x(0) + _head(self.message, self.io.width - 3) + self.io.ellipsis
+        elif width + 7 > self.io.width:
+            return self.io.move_x(0) + self.formatted_prefix() + _head(self.message, self.io.width - 10) + self.io.ellipsis
+        elif width + 7 == self.io.width:
+            return self.io.move_x(0) + self.formatted_prefix() + self.message
         else:
-            print(self.io.terminal.move_x(0) + self.formatted_prefix() + self.message + self.io.terminal.clear_eol, end='', flush=True)
+            return self.io.move_x(0) + self.formatted_prefix() + self.message + self.io.caps['clear_eol']
+
+    def render_rows(self):
+        if self.wrap and self.io.width >= 10 and _width(self.message) + 7 > self.io.width:
+            return [
+                self.io.move_x(0) + (self.formatted_prefix() if index == 0 else ' ' * 7) + row + (self.io.caps['clear_eol'] if row_width + 7 < self.io.width else '')
+                for index, (row, row_width) in enumerate(_layout(self.message, self.io.width - 7))
+            ]
+        return [self.render()]
 
     def formatted_prefix(self):
         interactive = self.is_interactive()
-        ret = self.io.terminal.bold('[') if interactive else '['
-        if self.prefix_color is not None and self.io is not None:
-            ret += getattr(self.io.terminal, self.prefix_color)(self.prefix[:4])
-        else:
-            ret += self.prefix[:4]
-        ret += self.io.terminal.bold(']') if interactive else ']'
-        return ret + ' '
+        key = (self.io, self.io._caps_version, self.prefix, self.prefix_color, interactive)
+        if self.__dict__.get('_formatted_prefix', (None, None))[0] != key:
+            ret = self.io.style('bold', '[') if interactive else '['
+            if self.prefix_color is not None and self.io is not None:
+                ret += self.io.style(self.prefix_color, self.prefix[:4])
+            else:
+                ret += self.prefix[:4]
+            ret += self.io.style('bold', ']') if interactive else ']'
+            self._formatted_prefix = (key, ret + ' ')
+        return self._formatted_prefix[1]
+
+    def render_key(self):
+        return (self.message, self.wrap, self.prefix, self.prefix_color, self.is_interactive())
+
+class RenderStats:
+    """Statistics about an IO's rendering, collected when passed to the IO as stats.
+
+    Times are in seconds, draw_time and draw_count are keyed by the name of the line class. If callback is given, it is called with this object after each update, e.g. to export the metrics.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    def __str__(self):
+        return '{} updates, {:.1f} lines/update, lock held {:.1f}ms/update, waited {:.1f}ms/update, {} bytes in {} writes'.format(
+            self.updates,
+            self.lines_drawn / max(self.updates, 1),
+            1000 * self.lock_held / max(self.updates, 1),
+            1000 * self.lock_wait / max(self.updates, 1),
+            self.bytes,
+            self.writes
+        )
+
+    def as_dict(self):
+        """Returns the statistics as a dict, suitable for exporting as JSON.
+        """
+        return {
+            'updates': self.updates,
+            'lock_held': self.lock_held,
+            'lock_wait': self.lock_wait,
+            'lines_drawn': self.lines_drawn,
+            'bytes': self.bytes,
+            'writes': self.writes,
+            'draw_time': dict(self.draw_time),
+            'draw_count': dict(self.draw_count)
+        }
+
+    def reset(self):
+        self.updates = 0
+        self.lock_held = 0.0
+        self.lock_wait = 0.0
+        self.lines_drawn = 0
+        self.bytes = 0
+        self.writes = 0
+        self.draw_time = {}
+        self.draw_count = {}
+
+class StatsLine(PrefixLine):
+    """A line which displays the IO's RenderStats, refreshed every update_interval seconds until the IO is closed.
+
+    Creates and attaches a RenderStats object if the IO doesn't have one yet.
+    """
+    def __init__(self, io, prefix='stat'):
+        super().__init__(io, prefix=prefix)
+        if io is not None:
+            if io.stats is None:
+                io.stats = RenderStats()
+            io.watch(self)
+
+    def is_running(self):
+        return self.io is not None and not self.io._closed
+
+    def poll(self):
+        if self.io is not None and self.io.stats is not None:
+            self.message = str(self.io.stats)
+        return self.is_running()
+
+class _RemoteLine(PrefixLine):
+    """A line which mirrors a line of a RemoteIO, see IO.listen.
+
+    The prefix is received already formatted. Lines without a prefix are displayed like a StringLine.
+    """
+    def __init__(self, io):
+        self.remote_prefix = None
+        self.connected = True
+        super().__init__(io, prefix='    ')
+
+    def __str__(self):
+        if self.remote_prefix is None:
+            return self.message
+        return super().__str__()
+
+    def formatted_prefix(self):
+        return self.remote_prefix
+
+    def is_running(self):
+        return self.connected
+
+    def render(self):
+        if self.remote_prefix is None:
+            return StringLine.render(self)
+        return super().render()
+
+    def render_rows(self):
+        if self.remote_prefix is None:
+            return StringLine.render_rows(self)
+        return super().render_rows()
+
+    def render_key(self):
+        return super().render_key() + (self.remote_prefix,)
+
+class _GapBuffer:
+    """A text buffer with a gap at the cursor, so that inserting or deleting text at the cursor only touches the affected characters.
+
+    The text before the gap is kept in order, the text after the gap in reverse order.
+    """
+    def __init__(self, text=''):
+        self._before = list(text)
+        self._after = []
+        self._text = text # cached result of str(self), or None
+
+    def __len__(self):
+        return len(self._before) + len(self._after)
+
+    def __str__(self):
+        if self._text is None:
+            self._text = ''.join(self._before) + ''.join(reversed(self._after))
+        return self._text
+
+    @property
+    def position(self):
+        return len(self._before)
+
+    @position.setter
+    def position(self, position):
+        self.move(position - len(self._before))
+
+    def delete(self):
+        """Delete the character before the gap.
+        """
+        self._before.pop()
+        self._text = None
+
+    def insert(self, text):
+        self._before.extend(text)
+        self._text = None
+
+    def move(self, distance):
+        """Move the gap by the given number of characters, to the right if positive and to the left if negative.
+        """
+        for _ in range(distance):
+            self._before.append(self._after.pop())
+        for _ in range(-distance):
+            self._after.append(self._before.pop())
 
 class InputLine(PrefixLine):
+    """A line which reads a line of input from the user.
+
+    The answer is kept in a gap buffer, so that typing and pasting in the middle of long answers is cheap. Pasted text is inserted all at once using the terminal's bracketed paste mode, with line breaks and other control characters replaced by spaces.
+    """
     def __init__(self, io, message='', prefix='????', prefix_color='yellow'):
-        self.answer = ''
-        self.position = 0
+        self._buffer = _GapBuffer()
         self.submitted = False
+        self._submitted = threading.Event()
         super().__init__(io, message=message, prefix=prefix, prefix_color=prefix_color)
 
+    def __str__(self):
+        return super().__str__() + self.answer
+
     def activate(self):
         if self.io is None or self.submitted:
             return
-        self.io.update()
-        sequence = ''
-        for ch in self.io._getch:
-            if self.io is None or self.submitted:
-                return
-            if sequence == '\x1b':
-                if ch == '[':
-                    sequence += ch
-                else:
-                    self.answer = self.answer[:self.position] + sequence + ch + self.answer[self.position:]
-                    self.position += 2
-                    sequence = ''
-            elif sequence == '\x1b[':
-                if ch == 'A': # up arrow
+        self.io.changed()
+        self.io.write('\x1b[?2004h') # enable bracketed paste
+        try:
+            while self.io is not None and not self.submitted:
+                direction, rest = self.feed_keys(self.io.read_keys())
+                self.io.unread(rest)
+                if direction == 'up':
                     if not self.io.activate_up():
-                        print('\x07', end='', flush=True)
-                    sequence = ''
-                    self.io.update()
-                elif ch == 'B': # down arrow
+                        self.io.write('\x07')
+                    self.io.write('\x1b[?2004h')
+                    self.io.changed()
+                elif direction == 'down':
                     if not self.io.activate_down():
-                        print('\x07', end='', flush=True)
-                    sequence = ''
-                    self.io.update()
-                elif ch == 'C': # right arrow
-                    if self.position >= len(self.answer):
-                        print('\x07', end='', flush=True)
-                        sequence = ''
-                    else:
-                        self.position += 1
-                        sequence = ''
-                        self.io.update()
-                elif ch == 'D': # left arrow
-                    if self.position <= 0:
-                        print('\x07', end='', flush=True)
-                        sequence = ''
-                    else:
-                        self.position -= 1
-                        sequence = ''
-                        self.io.update()
-                else:
-                    self.answer = self.answer[:self.position] + sequence + ch + self.answer[self.position:]
-                    self.position += 3
-                    sequence = ''
-                    self.io.update()
+                        self.io.write('\x07')
+                    self.io.write('\x1b[?2004h')
+                    self.io.changed()
+        finally:
+            if self.io is not None:
+                self.io.write('\x1b[?2004l')
+
+    async def activate_async(self):
+        if self.io is None or self.submitted:
+            return
+        self.io.changed()
+        self.io.write('\x1b[?2004h') # enable bracketed paste
+        try:
+            while self.io is not None and not self.submitted:
+                direction, rest = self.feed_keys(await self.io.read_keys())
+                self.io.unread(rest)
+                if direction == 'up':
+                    if not await self.io.activate_up():
+                        self.io.write('\x07')
+                    self.io.write('\x1b[?2004h')
+                    self.io.changed()
+                elif direction == 'down':
+                    if not await self.io.activate_down():
+                        self.io.write('\x07')
+                    self.io.write('\x1b[?2004h')
+                    self.io.changed()
+        finally:
+            if self.io is not None:
+                self.io.write('\x1b[?2004l')
+
+    @property
+    def answer(self):
+        return str(self._buffer)
+
+    @answer.setter
+    def answer(self, answer):
+        self._buffer = _GapBuffer(answer)
+
+    def feed(self, key):
+        """Process a single key event, as produced by IO.read_keys.
+
+        Returns 'up' or 'down' if the user wants to move to another line using the arrow keys, None otherwise.
+        """
+        if isinstance(key, _Paste):
+            self.insert(_PASTED_CONTROL.sub(' ', key)) # the answer is a single line, and control characters would move the cursor
+        elif key in ('\x1b[A', '\x1bOA'): # up arrow
+            return 'up'
+        elif key in ('\x1b[B', '\x1bOB'): # down arrow
+            return 'down'
+        elif key in ('\x1b[C', '\x1bOC'): # right arrow
+            if self.position >= len(self._buffer):
+                self.io.write('\x07')
             else:
-                sequence = ''
-                if ch in ['\r', '\n', '\x03', '\x04']:
-                    self.submitted = True
-                    self.io.update()
-                    return
-                elif ch == '\x7f':
-                    if self.position <= 0:
-                        print('\x07', end='', flush=True)
-                    else:
-                        self.answer = self.answer[:self.position - 1] + self.answer[self.position:]
-                        self.position -= 1
-                        self.io.update()
-                elif ch == '\x1b':
-                    sequence += ch
-                else:
-                    self.answer = self.answer[:self.position] + ch + self.answer[self.position:]
-                    self.position += 1
-                    self.io.update()
-            if self.io is None or self.submitted:
-                return
+                self.position += 1
+        elif key in ('\x1b[D', '\x1bOD'): # left arrow
+            if self.position <= 0:
+                self.io.write('\x07')
+            else:
+                self.position -= 1
+        elif key in ('\r', '\n', '\x03', '\x04'):
+            self.submitted = True
+            self._submitted.set()
+        elif key == '\x7f':
+            if self.position <= 0:
+                self.io.write('\x07')
+            else:
+                self._buffer.delete()
+                self.changed()
+        else:
+            self.insert(key)
+
+    def feed_keys(self, keys):
+        """Process a batch of key events. Consecutive typed characters are inserted all at once.
+
+        Stops early if the answer is submitted or an arrow key moves to another line. Returns that direction (or None) and the list of remaining keys.
+        """
+        run = [] # typed characters which have not been inserted yet
+        for i, key in enumerate(keys):
+            if len(key) == 1 and key >= ' ' and key != '\x7f' and not isinstance(key, _Paste):
+                run.append(key)
+                continue
+            if len(run) > 0:
+                self.insert(''.join(run))
+                run = []
+            direction = self.feed(key)
+            if direction is not None or self.submitted:
+                return direction, keys[i + 1:]
+        if len(run) > 0:
+            self.insert(''.join(run))
+        return None, []
+
+    def insert(self, text):
+        """Insert text into the answer at the cursor position.
+        """
+        self._buffer.insert(text)
+        self.changed()
 
-    def draw(self):
-        if self.io.terminal.width < 3:
-            print(self.io.terminal.move_x(0) + self.io.terminal.clear_eol, end='', flush=True)
-        elif self.io.terminal.width < 14:
-            print(self.io.terminal.move_x(0) + self.answer[:self.io.terminal.width - 3], end=self.io.terminal.black_on_cyan('...'), flush=True)
-        elif len(self.message) + len(self.answer) + 8 > self.io.terminal.width: # line does not fit on screen
-            if self.position != 0 and len(self.answer) - self.position + 11 < self.io.terminal.width: # display the end of the answer
-                if len(self.answer) + 11 < self.io.terminal.width:
-                    end_of_answer = self.message[-self.io.terminal.width + len(self.answer) + 11:] + self.io.terminal.bold(self.answer)
+    def render(self):
+        answer = self.answer
+        message_width = _width(self.message)
+        answer_width = _width(answer)
+        position = _width(answer[:self.position]) # the column of the cursor within the answer
+        if self.io.width < 3:
+            return self.io.move_x(0) + self.io.caps['clear_eol']
+        elif self.io.width < 14:
+            return self.io.move_x(0) + _head(answer, self.io.width - 3) + self.io.ellipsis
+        elif message_width + answer_width + 8 > self.io.width: # line does not fit on screen
+            if position != 0 and answer_width - position + 11 < self.io.width: # display the end of the answer
+                if answer_width + 11 < self.io.width:
+                    end_of_answer = _tail(self.message, self.io.width - answer_width - 11) + self.io.style('bold', answer)
                 else:
-                    end_of_answer = self.io.terminal.bold(self.answer[-self.io.terminal.width + 11:])
-                print(self.io.terminal.move_x(0) + self.formatted_prefix() + self.io.terminal.black_on_cyan('...') + end_of_answer + ' ' + self.io.terminal.move_x(self.io.terminal.width - 1 - len(self.answer) + self.position), end='', flush=True)
+                    end_of_answer = self.io.style('bold', _tail(answer, self.io.width - 11))
+                return self.io.move_x(0) + self.formatted_prefix() + self.io.ellipsis + end_of_answer + ' ' + self.io.move_x(self.io.width - 1 - answer_width + position)
             else:
-                section = (len(self.message) + self.position - 3) // (self.io.terminal.width - 13)
+                section = (message_width + position - 3) // (self.io.width - 13)
                 if section <= 0:
-                    print(self.io.terminal.move_x(0) + self.formatted_prefix() + self.message + self.io.terminal.bold(self.answer[:self.io.terminal.width - len(self.message) - 10]) + self.io.terminal.black_on_cyan('...') + self.io.terminal.move_x(7 + len(self.message) + self.position), end='', flush=True)
+                    return self.io.move_x(0) + self.formatted_prefix() + self.message + self.io.style('bold', _head(answer, self.io.width - message_width - 10)) + self.io.ellipsis + self.io.move_x(7 + message_width + position)
                 else:
-                    if len(self.message) > 3 + section * (self.io.terminal.width - 13):
-                        partial_message = self.message[3 + section * (self.io.terminal.width - 13):]
-                        partial_answer = partial_message + self.io.terminal.bold(self.answer[:self.io.terminal.width - len(partial_message) - 13])
+                    if message_width > 3 + section * (self.io.width - 13):
+                        partial_message = _skip(self.message, 3 + section * (self.io.width - 13))
+                        partial_answer = partial_message + self.io.style('bold', _head(answer, self.io.width - _width(partial_message) - 13))
                     else:
-                        partial_answer = self.io.terminal.bold(self.answer[section * (self.io.terminal.width - 13) - len(self.message) + 3:][:self.io.terminal.width - 13])
-                    print(self.io.terminal.move_x(0) + self.formatted_prefix() + self.io.terminal.black_on_cyan('...') + partial_answer + self.io.terminal.black_on_cyan('...') + self.io.terminal.move_x(7 + len(self.message) + self.position - section * (self.io.terminal.width - 13)), end='', flush=True)
-        elif len(self.message) + len(self.answer) + 8 == self.io.terminal.width: # line fits exactly on screen
-            print(self.io.terminal.move_x(0) + self.formatted_prefix() + self.message + self.io.terminal.bold(self.answer) + self.io.terminal.move_x(7 + len(self.message) + self.position), end='', flush=True)
+                        partial_answer = self.io.style('bold', _head(_skip(answer, section * (self.io.width - 13) - message_width + 3), self.io.width - 13))
+                    return self.io.move_x(0) + self.formatted_prefix() + self.io.ellipsis + partial_answer + self.io.ellipsis + self.io.move_x(7 + message_width + position - section * (self.io.width - 13))
+        elif message_width + answer_width + 8 == self.io.width: # line fits exactly on screen
+            return self.io.move_x(0) + self.formatted_prefix() + self.message + self.io.style('bold', answer) + self.io.move_x(7 + message_width + position)
         else:
-            print(self.io.terminal.move_x(0) + self.formatted_prefix() + self.message + self.io.terminal.bold(self.answer) + self.io.terminal.clear_eol + self.io.terminal.move_x(7 + len(self.message) + self.position), end='', flush=True)
+            return self.io.move_x(0) + self.formatted_prefix() + self.message + self.io.style('bold', answer) + self.io.caps['clear_eol'] + self.io.move_x(7 + message_width + position)
 
     def is_interactive(self):
         return not self.submitted
 
+    def stream_event(self):
+        return 'answer' if self.submitted else 'prompt'
+
+    def render_key(self):
+        return super().render_key() + (self.answer, self.position)
+
+    @property
+    def position(self):
+        """The cursor position within the answer.
+        """
+        return self._buffer.position
+
+    @position.setter
+    def position(self, position):
+        self._buffer.position = position
+
     def join(self, update_interval=0.1):
         """Blocks until input has been submitted, then returns that input.
         """
@@ -214,8 +815,17 @@ class InputLine(PrefixLine):
             if self.io.active_line is None:
                 self.io.activate(self)
             else:
-                self.io.update()
-                time.sleep(update_interval)
+                self._submitted.wait(update_interval) # another line is reading input, wait until it's done
+        return self.answer
+
+    async def join_async(self):
+        """Waits until input has been submitted, then returns that input. For use with AsyncIO.
+        """
+        while not self.submitted:
+            if self.io.active_line is None:
+                await self.io.activate(self)
+            else:
+                await asyncio.sleep(self.io.update_interval) # another line is reading input, wait until it's done
         return self.answer
 
 class TaskLine(PrefixLine):
@@ -226,36 +836,71 @@ class TaskLine(PrefixLine):
         self.prefix_formatter = lambda x: x
         super().__init__(io, message=message, prefix='....')
 
-    def draw(self):
+    def draw(self, row=0):
         self.update_progress()
-        super().draw()
+        super().draw(row)
 
     def formatted_prefix(self):
         interactive = self.is_interactive()
-        ret = self.io.terminal.bold('[') if interactive else '['
-        ret += self.prefix_formatter(self.prefix)
-        ret += self.io.terminal.bold(']') if interactive else ']'
-        return ret + ' '
+        key = (self.io, self.io._caps_version, self.prefix, self.prefix_formatter, interactive)
+        if self.__dict__.get('_formatted_prefix', (None, None))[0] != key:
+            ret = self.io.style('bold', '[') if interactive else '['
+            ret += self.prefix_formatter(self.prefix)
+            ret += self.io.style('bold', ']') if interactive else ']'
+            self._formatted_prefix = (key, ret + ' ')
+        return self._formatted_prefix[1]
+
+    def render_key(self):
+        return super().render_key() + (self.prefix_formatter,)
+
+    def is_running(self):
+        return self.thread.is_alive()
 
     def join(self, update_interval=0.1):
+        """Blocks until the thread has finished.
+
+        While the thread is running, its progress is polled by the IO's renderer, so update_interval is ignored.
+        """
         try:
-            self.thread.start()
+            self.start()
         except RuntimeError:
             pass # thread is already running
-        while self.thread.is_alive():
-            if self.io is not None:
-                self.io.update()
-            if self.thread.is_alive():
-                time.sleep(update_interval)
-        if self.io is not None:
-            self.io.update()
         self.thread.join()
         self.update_progress(progress=1.0)
-        if self.io is not None:
-            self.io.update()
+
+    def notify(self):
+        """Update the progress from the thread, which is redrawn only if it has visibly changed.
+
+        This is called by reporters and, if the thread has an add_done_callback method, when the thread finishes. Other threads are polled by the IO instead.
+        """
+        if not self.poll() and self.io is not None:
+            self.io._reporting.pop(getattr(self.thread, 'key', None), None)
+
+    def poll(self):
+        """Update the progress from the thread. Returns False once the thread has finished.
+        """
+        if self.thread.is_alive():
+            self.update_progress()
+            return True
+        self.update_progress(progress=1.0)
+        return False
 
     def start(self):
         self.thread.start()
+        self._started = True
+        self.changed()
+        if hasattr(self.thread, 'add_done_callback'):
+            self.thread.add_done_callback(lambda thread: self.notify())
+        elif self.io is not None:
+            self.io.watch(self)
+
+    def stream_event(self):
+        if not self.__dict__.get('_started', False):
+            return None
+        if self.thread.is_alive():
+            return 'start'
+        self.poll()
+        return {' ok ': 'ok', 'FAIL': 'failed'}.get(self.prefix, self.prefix.strip())
 
     def update_progress(self, progress=None, state=None):
         if progress is not None:
@@ -280,112 +925,738 @@ class TaskLine(PrefixLine):
                 if state is None:
                     state = ' ok '
                     if self.io is not None:
-                        self.prefix_formatter = self.io.terminal.green
+                        self.prefix_formatter = self.io._formatter('green')
                 self.prefix = state
             else:
-                self.prefix = '=' * fifths + '.' * (4 - fifths)
+                self.prefix = _progress_bar(progress)
         else:
             self.prefix = state
 
-class SleepLine(TaskLine):
-    def __init__(self, io, end, message=None):
-        class SleepThread(threading.Thread):
-            def __init__(self, delta):
-                self.delta = delta.total_seconds()
-                self.progress = 0.0
-                self.state = None
-                super().__init__()
-
-            def run(self):
-                if self.delta <= 0:
-                    self.progress = 1.0
-                    return
-                for progress in range(5):
-                    time.sleep(self.delta / 5)
-                    self.progress = (progress + 1) / 5
+class TaskGroupLine(PrefixLine):
+    """A single line which represents a group of tasks, showing how many of them are done, running and failed, the overall progress, the throughput and the estimated time remaining.
 
-        if isinstance(end, datetime.datetime):
-            # sleep until datetime
-            thread = SleepThread(delta=(end - datetime.datetime.now(datetime.timezone.utc)))
-            if message is None:
-                if end.date() == datetime.date.today():
-                    date_string = end.strftime('%H:%M:%S')
+    The message is kept in the title attribute, the message attribute also includes the counts. Tasks are added as concurrent.futures.Future objects. Their progress is kept in the progress array, which is read when the line is polled, so the tasks don't need lines of their own. Failed tasks, as well as tasks which have been running for more than slow seconds, are expanded into lines of their own below the group line.
+    """
+    def __init__(self, io, total, message='', slow=None):
+        self.total = total
+        self.slow = slow
+        self.futures = []
+        self.labels = []
+        self.progress = array.array('d', [0.0] * total)
+        self.states = {} # task states reported through the tasks' reporters
+        self.done = 0
+        self.running = 0
+        self.failed = 0
+        self.title = message
+        self.prefix_formatter = lambda x: x
+        self._lock = threading.Lock()
+        self._unfinished = []
+        self._started = {} # maps task indices to the time they were first seen running
+        self._details = {} # maps task indices to their expanded lines
+        self._keys = {} # maps task indices to their reporter keys, see IO._reporting
+        self._start_time = time.monotonic()
+        super().__init__(io, message=message, prefix='....')
+
+    def add(self, future, label=''):
+        """Add a task to the group. Returns its index in the progress array.
+        """
+        with self._lock:
+            index = len(self.futures)
+            self.futures.append(future)
+            self.labels.append(label)
+            self._unfinished.append(index)
+        return index
+
+    formatted_prefix = TaskLine.formatted_prefix
+
+    def is_running(self):
+        return self.done + self.failed < self.total
+
+    def poll(self):
+        """Update the counts and progress from the tasks. Returns False once all tasks have finished.
+
+        The group is polled by both the renderer and IO.map, so this holds the lock.
+        """
+        with self._lock:
+            return self._poll()
+
+    def _poll(self):
+        """Does the work of poll while holding the lock.
+        """
+        now = time.monotonic()
+        running = 0
+        progress = 0.0
+        unfinished, self._unfinished = self._unfinished, []
+        for index in unfinished:
+            future = self.futures[index]
+            if future.done():
+                if future.cancelled() or future.exception() is not None:
+                    self.failed += 1
+                    self._expand(index, 'FAIL', self.labels[index] + ': ' + ('cancelled' if future.cancelled() else repr(future.exception())))
                 else:
-                    date_string = end.strftime('%Y-%m-%d %H:%M:%S')
-                message = 'sleeping until ' + date_string
+                    self.done += 1
+                    self.progress[index] = 1.0
+                    detail = self._details.pop(index, None)
+                    if detail is not None and self.io is not None and detail in self.io: # it may have been moved into the history, see IO.scrollback
+                        del self.io.lines[self.io.index(detail)]
+                        self.io.changed()
+                if self.io is not None:
+                    self.io._reporting.pop(self._keys.pop(index, None), None)
+            else:
+                self._unfinished.append(index)
+                progress += self.progress[index]
+                if future.running():
+                    running += 1
+                    started = self._started.setdefault(index, now)
+                    if self.slow is not None and now - started > self.slow:
+                        self._expand(index, self.states.get(index) or _progress_bar(self.progress[index]), '{} (running for {})'.format(self.labels[index], datetime.timedelta(seconds=int(now - started))))
+        self.running = running
+        finished = self.done + self.failed
+        progress = (progress + finished) / self.total if self.total > 0 else 1.0
+        status = '{}/{} done, {} running'.format(self.done, self.total, running)
+        if self.failed > 0:
+            status += ', {} failed'.format(self.failed)
+        if finished > 0:
+            rate = finished / (now - self._start_time)
+            status += ', {:.1f}/s'.format(rate)
+            if finished < self.total and progress > 0:
+                status += ', ETA ' + str(datetime.timedelta(seconds=int((now - self._start_time) * (1 - progress) / progress)))
+        self.message = '{} ({})'.format(self.title, status)
+        if finished < self.total:
+            self.prefix = _progress_bar(progress)
+            return True
+        if self.failed > 0:
+            self.prefix = 'FAIL'
+            if self.io is not None:
+                self.prefix_formatter = self.io._formatter('red')
         else:
-            # sleep for time interval
-            if not isinstance(end, datetime.timedelta):
-                end = datetime.timedelta(seconds=end)
-            thread = SleepThread(delta=end)
-            if message is None:
-                if end.total_seconds() >= 86400:
-                    date_string = str(end.total_seconds() // 86400) + ' days'
-                elif end.total_seconds() >= 3600:
-                    date_string = str(end.total_seconds() // 3600) + ' hours'
-                elif end.total_seconds() >= 60:
-                    date_string = str(end.total_seconds() // 60) + ' minutes'
-                elif end.total_seconds() >= 1:
-                    date_string = str(int(end.total_seconds())) + ' seconds'
-                else:
-                    date_string = str(int(end.total_seconds() * 1000)) + ' milliseconds'
-                message = 'sleeping for ' + date_string
-        super().__init__(io, thread=thread, message=message)
+            self.prefix = ' ok '
+            if self.io is not None:
+                self.prefix_formatter = self.io._formatter('green')
+        return False
 
-class IO:
-    def __init__(self, terminal=None):
-        if terminal is None:
-            import blessings
-            terminal = blessings.Terminal()
-        self.terminal = terminal
-        self.lines = []
-        self.max_lines = 1
-        self.position = 0
-        self.active_line = None
-        self.update_lock = threading.Lock()
-        self._getch = None
+    def render_key(self):
+        return super().render_key() + (self.prefix_formatter,)
 
-    def __contains__(self, item):
-        return item in self.lines
+    def stream_event(self):
+        if self.is_running():
+            return 'start'
+        return 'failed' if self.failed > 0 else 'ok'
 
-    def __delitem__(self, key):
-        if key < self.max_lines - self.terminal.height:
-            raise IndexError('Line has scrolled out of screen')
-        del self.lines[key]
-        self.update()
+    def _expand(self, index, prefix, message):
+        detail = self._details.get(index)
+        if detail is None:
+            detail = PrefixLine(None, message=message, prefix=prefix, prefix_color='red' if prefix == 'FAIL' else None)
+            self._details[index] = detail
+            if self.io is not None:
+                self.io.insert(self.io.index(self) + len(self._details), detail)
+        else:
+            detail.prefix = prefix
+            detail.message = message
+            detail.prefix_color = 'red' if prefix == 'FAIL' else None
 
-    def __enter__(self):
-        self._getch = _getch()
-        return self
+class _GroupSlot:
+    """The task a Reporter reports to for a task in a TaskGroupLine.
+    """
+    def __init__(self, group, index):
+        self.group = group
+        self.index = index
 
-    def __exit__(self, exception_type, exception_val, trace):
-        """Update everything and print a newline after the last line
-        """
-        self.active_line = None
-        self.update()
-        print(self.terminal.move_x(0), end='', flush=True)
-        if len(self):
-            print(flush=True)
-        del self._getch
-        return exception_type is None # re-raise any exceptions
+    @property
+    def progress(self):
+        return self.group.progress[self.index]
 
-    def __getitem__(self, key):
-        return self.lines[key]
+    @progress.setter
+    def progress(self, progress):
+        self.group.progress[self.index] = progress
 
-    def __iter__(self):
-        return iter(self.lines)
+    @property
+    def state(self):
+        return self.group.states.get(self.index)
 
-    def __len__(self):
-        return len(self.lines)
+    @state.setter
+    def state(self, state):
+        self.group.states[self.index] = state
 
-    def __setitem__(self, key, value):
-        self.lines[key] = value
-        self.update()
+class _FutureTask:
+    """Wraps a function call submitted to a concurrent.futures.Executor in the interface of a threading.Thread, so that it can be displayed by a TaskLine.
+    """
+    def __init__(self, executor, func, args, kwargs):
+        self.executor = executor
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = None
+        self.progress = 0.0
+        self._state = None
 
-    def activate(self, line):
+    @property
+    def key(self):
+        reporter = self.kwargs.get('reporter')
+        return None if reporter is None else reporter._key
+
+    @property
+    def state(self):
+        if self.future is not None and self.future.done() and (self.future.cancelled() or self.future.exception() is not None):
+            return 'FAIL'
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        self._state = state
+
+    def add_done_callback(self, fn):
+        """Call fn with this task once it has finished. The task must have been started.
+        """
+        self.future.add_done_callback(lambda future: fn(self))
+
+    def is_alive(self):
+        return self.future is not None and not self.future.done()
+
+    def join(self):
+        concurrent.futures.wait([self.future])
+
+    def start(self):
+        if self.future is not None:
+            raise RuntimeError('tasks can only be started once')
+        self.future = self.executor.submit(self.func, *self.args, **self.kwargs)
+
+class _TaskThread(threading.Thread):
+    """The thread in which IO.do runs a function. Calls callbacks when it finishes, so that its line doesn't need to be polled.
+
+    If the function raises an exception, it is kept in the exception attribute and the state is set to FAIL, like for functions run on an executor.
+    """
+    def __init__(self, target, args, kwargs):
+        self.progress = 0.0
+        self.state = None
+        self.exception = None
+        self._finished = False
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+        super().__init__(target=target, args=args, kwargs=kwargs)
+
+    def add_done_callback(self, fn):
+        """Call fn with this thread once it has finished, or right away if it already has.
+        """
+        with self._callbacks_lock:
+            if not self._finished:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def is_alive(self):
+        return not self._finished and super().is_alive()
+
+    def run(self):
+        try:
+            super().run()
+        except BaseException as exception:
+            self.exception = exception
+            self.state = 'FAIL'
+            raise # still reported by threading.excepthook
+        finally:
+            with self._callbacks_lock:
+                self._finished = True
+                callbacks, self._callbacks = self._callbacks, None
+            for fn in callbacks:
+                fn(self)
+
+class _Scheduler:
+    """Calls functions at given times, from a single thread which only runs while there are pending calls.
+
+    Pending calls are kept in a heap, so scheduling a call costs O(log n).
+    """
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count() # breaks ties between calls scheduled for the same time
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def call_at(self, when, func):
+        """Call func without arguments at the given time.monotonic() time.
+        """
+        with self._condition:
+            heapq.heappush(self._heap, (when, next(self._counter), func))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='fancyio scheduler', daemon=True)
+                self._thread.start()
+            else:
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if len(self._heap) == 0:
+                        self._thread = None
+                        return
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                _, _, func = heapq.heappop(self._heap)
+            try:
+                func()
+            except Exception:
+                sys.excepthook(*sys.exc_info()) # report the error but keep running, so that later calls still happen
+
+class _Sleep:
+    """Sleeps for the given datetime.timedelta using a _Scheduler instead of a thread of its own, in the interface of a threading.Thread.
+
+    The progress is calculated from the current time whenever it is read.
+    """
+    def __init__(self, scheduler, delta):
+        self.scheduler = scheduler
+        self.delta = delta.total_seconds()
+        self.state = None
+        self.started = None
+        self._finished = threading.Event()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    @property
+    def progress(self):
+        if self.started is None:
+            return 0.0
+        if self.delta <= 0 or self._finished.is_set():
+            return 1.0
+        return min(1.0, (time.monotonic() - self.started) / self.delta)
+
+    def add_done_callback(self, fn):
+        """Call fn with this sleep once it has finished, or right away if it already has.
+        """
+        with self._callbacks_lock:
+            if not self._finished.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def is_alive(self):
+        return self.started is not None and not self._finished.is_set()
+
+    def join(self):
+        self._finished.wait()
+
+    def start(self):
+        if self.started is not None:
+            raise RuntimeError('sleeps can only be started once')
+        self.started = time.monotonic()
+        self.scheduler.call_at(self.started + self.delta, self._finish)
+
+    def _finish(self):
+        with self._callbacks_lock:
+            self._finished.set()
+            callbacks, self._callbacks = self._callbacks, None
+        for fn in callbacks:
+            fn(self)
+
+class _AsyncTask:
+    """Wraps an awaitable in the interface of a threading.Thread, so that it can be displayed by a TaskLine.
+
+    The progress and state attributes are taken from the awaitable, if it has them, unless they have been reported through a Reporter.
+    """
+    def __init__(self, awaitable):
+        self.awaitable = awaitable
+        self.task = None
+        self._progress = None
+        self._state = None
+
+    @property
+    def progress(self):
+        if self._progress is not None:
+            return self._progress
+        return self.awaitable.progress
+
+    @progress.setter
+    def progress(self, progress):
+        self._progress = progress
+
+    @property
+    def state(self):
+        if self._state is not None:
+            return self._state
+        return self.awaitable.state
+
+    @state.setter
+    def state(self, state):
+        self._state = state
+
+    def is_alive(self):
+        return self.task is not None and not self.task.done()
+
+    def join(self):
+        raise RuntimeError('cannot join an asyncio task from a thread, await it instead')
+
+    def start(self):
+        if self.task is not None:
+            raise RuntimeError('tasks can only be started once')
+        self.task = asyncio.ensure_future(self.awaitable)
+
+class _AsyncSleep:
+    """An awaitable which sleeps for the given datetime.timedelta and reports its progress.
+    """
+    def __init__(self, delta):
+        self.delta = delta.total_seconds()
+        self.start = asyncio.get_event_loop().time()
+
+    def __await__(self):
+        return asyncio.sleep(self.delta).__await__()
+
+    @property
+    def progress(self):
+        if self.delta <= 0:
+            return 1.0
+        return min(1.0, (asyncio.get_event_loop().time() - self.start) / self.delta)
+
+class SleepLine(TaskLine):
+    def __init__(self, io, end, message=None):
+        if isinstance(end, datetime.datetime):
+            # sleep until datetime
+            delta = end - datetime.datetime.now(datetime.timezone.utc)
+            if message is None:
+                if end.date() == datetime.date.today():
+                    date_string = end.strftime('%H:%M:%S')
+                else:
+                    date_string = end.strftime('%Y-%m-%d %H:%M:%S')
+                message = 'sleeping until ' + date_string
+        else:
+            # sleep for time interval
+            if not isinstance(end, datetime.timedelta):
+                end = datetime.timedelta(seconds=end)
+            delta = end
+            if message is None:
+                if end.total_seconds() >= 86400:
+                    date_string = str(end.total_seconds() // 86400) + ' days'
+                elif end.total_seconds() >= 3600:
+                    date_string = str(end.total_seconds() // 3600) + ' hours'
+                elif end.total_seconds() >= 60:
+                    date_string = str(end.total_seconds() // 60) + ' minutes'
+                elif end.total_seconds() >= 1:
+                    date_string = str(int(end.total_seconds())) + ' seconds'
+                else:
+                    date_string = str(int(end.total_seconds() * 1000)) + ' milliseconds'
+                message = 'sleeping for ' + date_string
+        super().__init__(io, thread=_Sleep(_Scheduler(), delta) if io is None else io._sleeper(delta), message=message)
+
+    def start(self):
+        super().start()
+        if isinstance(self.thread, _Sleep):
+            for step in range(1, 5): # redraw whenever the progress bar changes
+                self.thread.scheduler.call_at(self.thread.started + self.thread.delta * step / 5, self.notify)
+
+class Reporter:
+    """Passed to functions run by IO.do with report=True, to report their progress to the TaskLine.
+
+    Reporters can be pickled, so that functions running in a process pool can report their progress through a queue.
+    """
+    def __init__(self, channel=None, key=None):
+        self._channel = channel
+        self._key = key
+        self._task = None
+        self._line = None # notified of reported progress, see TaskLine.notify
+        self._steps = 0
+        self._total = None
+
+    def __getstate__(self):
+        if self._channel is None:
+            raise TypeError('only reporters for process pools can be pickled')
+        return {'_channel': self._channel, '_key': self._key, '_task': None, '_line': None, '_steps': self._steps, '_total': self._total}
+
+    def _apply(self, attr, value):
+        setattr(self._task, attr, value)
+        if self._line is not None:
+            self._line.notify()
+
+    def _set(self, attr, value):
+        if self._channel is None:
+            self._apply(attr, value)
+        else:
+            self._channel.put((self._key, attr, value))
+
+    def advance(self, n=1, total=None):
+        """Count n more steps as done, and set the progress to the fraction of the total number of steps. The total only needs to be given once, or when it changes.
+        """
+        if total is not None:
+            self._total = total
+        self._steps += n
+        if self._total:
+            self._set('progress', min(self._steps / self._total, 1.0))
+
+    def set_progress(self, progress):
+        """Set the progress of the task to a number between 0.0 and 1.0.
+        """
+        self._set('progress', progress)
+
+    def set_state(self, state):
+        """Set the state of the task, which is displayed instead of the progress. Setting it to None displays the progress again.
+        """
+        self._set('state', state)
+
+class LineList(collections.abc.MutableSequence):
+    """A list of lines which keeps track of the position of each line, so that looking up a line's index takes constant time. Each line should appear at most once.
+
+    It also keeps a separate index of the lines which may be interactive, so that moving between them does not require scanning every line. Changes and lookups are serialized by a lock, since lines are added by the program's threads while the renderer moves finished lines into the history.
+    """
+    def __init__(self, lines=()):
+        self._lines = list(lines)
+        self._positions = {} # maps lines to their index, entries are only valid if they are below self._valid
+        self._valid = 0
+        self._interactive = {} # lines whose class overrides is_interactive, used as an ordered set
+        self._lock = threading.Lock()
+        for line in self._lines:
+            self._add(line)
+
+    def __add__(self, other):
+        return self._lines + list(other)
+
+    def __contains__(self, item):
+        try:
+            self.index(item)
+        except ValueError:
+            return False
+        return True
+
+    def __delitem__(self, key):
+        with self._lock:
+            if isinstance(key, slice):
+                removed = self._lines[key]
+                start = key.indices(len(self._lines))[0] if key.step is None or key.step > 0 else 0
+            else:
+                removed = [self._lines[key]]
+                start = key % len(self._lines)
+            del self._lines[key]
+            self._invalidate(start)
+            for line in removed:
+                self._remove(line)
+
+    def __eq__(self, other):
+        if isinstance(other, LineList):
+            other = other._lines
+        return self._lines == other
+
+    def __getitem__(self, key):
+        return self._lines[key]
+
+    def __iter__(self):
+        return iter(self._lines)
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __radd__(self, other):
+        return list(other) + self._lines
+
+    def __repr__(self):
+        return 'LineList({!r})'.format(self._lines)
+
+    def __reversed__(self):
+        return reversed(self._lines)
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            value = list(value)
+        with self._lock:
+            if isinstance(key, slice):
+                removed = self._lines[key]
+                start = key.indices(len(self._lines))[0] if key.step is None or key.step > 0 else 0
+            else:
+                removed = [self._lines[key]]
+                start = key % len(self._lines)
+            self._lines[key] = value
+            self._invalidate(start)
+            for line in removed:
+                self._remove(line)
+            for line in (value if isinstance(key, slice) else [value]):
+                self._add(line)
+
+    def _add(self, line):
+        if type(line).is_interactive is not Line.is_interactive:
+            self._interactive[line] = None
+
+    def _invalidate(self, position):
+        self._valid = min(self._valid, position)
+
+    def _remove(self, line):
+        self._positions.pop(line, None)
+        self._interactive.pop(line, None)
+
+    def append(self, line):
+        with self._lock:
+            if self._valid == len(self._lines):
+                self._positions.setdefault(line, self._valid)
+                self._valid += 1
+            self._lines.append(line)
+            self._add(line)
+
+    def clear(self):
+        del self[:]
+
+    def index(self, line):
+        with self._lock:
+            position = self._positions.get(line)
+            if position is None or position >= self._valid:
+                for position in reversed(range(self._valid, len(self._lines))):
+                    self._positions[self._lines[position]] = position
+                self._valid = len(self._lines)
+                position = self._positions.get(line)
+            if position is None or position >= len(self._lines) or self._lines[position] is not line:
+                raise ValueError('{!r} is not in list'.format(line))
+            return position
+
+    def insert(self, position, line):
+        with self._lock:
+            position = min(max(position + len(self._lines) if position < 0 else position, 0), len(self._lines))
+            self._lines.insert(position, line)
+            self._invalidate(position)
+            self._add(line)
+
+    def interactive(self):
+        """Returns the currently interactive lines along with their positions, in order.
+        """
+        return sorted((self.index(line), line) for line in list(self._interactive) if line.is_interactive())
+
+    def reverse(self):
+        with self._lock:
+            self._lines.reverse()
+            self._invalidate(0)
+
+class IO:
+    def __init__(self, terminal=None, stream=None, max_fps=30, update_interval=0.1, scrollback=None, stats=None, mode=None):
+        """Create a new IO object which draws to the given blessings terminal.
+
+        The terminal's size and escape sequences are captured once, and refreshed when the terminal is resized. Output is written to stream, which defaults to sys.stdout. Changes are drawn by a background thread, at most max_fps times per second (or as fast as possible if max_fps is None). The progress of running tasks is polled every update_interval seconds.
+
+        If scrollback is not None, lines which have scrolled out of screen and are neither running nor interactive are removed from the lines, which shifts the indices of the remaining lines. In the streaming modes, this applies to lines which are followed by more lines than fit on screen, once they have been written. The text of the last scrollback removed lines is kept in the history attribute.
+
+        If stats is a RenderStats object, it is used to collect statistics about rendering, which has some overhead.
+
+        The mode is one of 'terminal', 'stream' and 'json', and defaults to 'terminal' if the stream is a tty and 'stream' otherwise. In the streaming modes, nothing is redrawn: each line is appended to the stream as plain text once it is finalized, and task lines are appended again when they start and finish. The 'json' mode writes each of these as a JSON object on its own line.
+        """
+        if mode is None:
+            isatty = getattr(sys.stdout if stream is None else stream, 'isatty', None)
+            mode = 'terminal' if isatty is not None and isatty() else 'stream'
+        if mode not in ('terminal', 'stream', 'json'):
+            raise ValueError('unknown mode: {!r}'.format(mode))
+        self.mode = mode
+        if terminal is None:
+            import blessings
+            terminal = blessings.Terminal()
+        self.terminal = terminal
+        self.stream = stream
+        self._caps_version = 0
+        self._refresh_terminal()
+        self._resized = False
+        self._old_sigwinch = None
+        self._watching_resize = False # whether SIGWINCH is handled, if not the size is checked on each update
+        self._stream_pending = {} # lines which have changed since they were last written in the streaming modes, used as an ordered set, see _update_stream
+        self.lines = LineList()
+        self.max_lines = 1
+        self.position = 0
+        self.active_line = None
+        self.max_fps = max_fps
+        self.stats = stats
+        self.scrollback = scrollback
+        self.history = collections.deque(maxlen=scrollback)
+        self.update_interval = update_interval
+        self.update_lock = threading.Lock()
+        self._changed = threading.Event()
+        self._renderer = None
+        self._renderer_lock = threading.Lock()
+        self._closed = False # once closed, no renderer is started, see changed
+        self._tasks = set() # running task lines whose progress is polled by the renderer
+        self._manager = None
+        self._channel = None # queue for progress reported from other processes, see _process_channel
+        self._report_keys = itertools.count()
+        self._reporting = {} # maps reporter keys to the reporters in this process which apply the progress reported from other processes
+        self._listener = None # thread which applies the progress reported through _channel
+        self._scheduler = _Scheduler() # drives SleepLines
+        self._keys = None # generator of key event lists, see _read_keys
+        self._unread = []
+        self._local = threading.local() # per thread state: the current frame, see _frame, and whether the thread is the renderer, see changed
+        self._screen = {} # maps each row that is currently on screen to the line drawn there and which of its rows it is
+        self._shadow = {} # maps rows to their content as last drawn, as returned by _parse_row, see _diff
+        self._tall = {} # maps the lines which took up more than one row when they were last laid out to their number of rows
+        self._compositor = None # thread which receives the lines of RemoteIOs, see listen
+        self._compositor_wakeup = None # socket used to stop the compositor thread
+        self._size = None
+        self._formatters = {} # see _formatter
+        self._stream_ids = itertools.count() # ids of the lines in json mode
+
+    def __contains__(self, item):
+        return item in self.lines
+
+    def __delitem__(self, key):
+        if self._row(key) < self.max_lines - self.height:
+            raise IndexError('Line has scrolled out of screen')
+        del self.lines[key]
+        self.changed()
+
+    def __enter__(self):
+        self._closed = False
+        self._keys = _read_keys()
+        try:
+            self._old_sigwinch = signal.signal(signal.SIGWINCH, self._on_resize)
+            self._watching_resize = True
+        except ValueError:
+            pass # not in the main thread
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        """Update everything and print a newline after the last line
+        """
+        self._close()
+        self._keys.close()
+        self._keys = None
+        if self._watching_resize:
+            signal.signal(signal.SIGWINCH, self._old_sigwinch)
+            self._watching_resize = False
+        return exception_type is None # re-raise any exceptions
+
+    def __getitem__(self, key):
+        return self.lines[key]
+
+    @property
+    def lines(self):
+        """The lines of this IO object, as a LineList. Any iterable of lines may be assigned to this.
+        """
+        return self._lines
+
+    @lines.setter
+    def lines(self, lines):
+        self._lines = lines if isinstance(lines, LineList) else LineList(lines)
+        if self.mode != 'terminal':
+            self._stream_pending.update(dict.fromkeys(self._lines))
+
+    @property
+    def _frame(self):
+        """The list of strings which will be written at the end of the current thread's frame, or None if it isn't in a frame.
+
+        Frames are kept per thread, so that what other threads write, e.g. the bell from an InputLine, doesn't end up in the middle of a line drawn by the renderer.
+        """
+        return getattr(self._local, 'frame', None)
+
+    @_frame.setter
+    def _frame(self, frame):
+        self._local.frame = frame
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            value = list(value)
+        self.lines[key] = value
+        for line in (value if isinstance(key, slice) else [value]):
+            self._line_changed(line)
+        self.changed()
+
+    def activate(self, line):
         if (line is None) or (line in self):
             self.active_line = line
-            self.update()
+            self.changed()
             if line is not None:
                 if line.is_interactive():
                     line.activate()
@@ -395,48 +1666,98 @@ class IO:
 
     def activate_down(self):
         prev_active_line = self.active_line
-        for line in (self.lines if self.active_line is None else self.lines[self.index(self.active_line) + 1:]):
-            if line.is_interactive():
-                self.activate(line)
-                self.active_line = prev_active_line
-                return True
-        return False
+        line = self._next_interactive(down=True)
+        if line is None:
+            return False
+        self.activate(line)
+        self.active_line = prev_active_line
+        return True
 
     def activate_up(self):
         prev_active_line = self.active_line
-        for line in reversed(self.lines if self.active_line is None else self.lines[:self.index(self.active_line)]):
-            if line.is_interactive():
-                self.activate(line)
-                self.active_line = prev_active_line
-                return True
-        return False
+        line = self._next_interactive(down=False)
+        if line is None:
+            return False
+        self.activate(line)
+        self.active_line = prev_active_line
+        return True
 
     def append(self, line):
         self.lines.append(line)
-        self.update()
+        self._line_changed(line)
 
     def clear(self):
         """Delete all lines.
         """
-        self.lines = []
-        self.update()
+        self.lines = LineList()
+        self.changed()
 
-    def do(self, func, message='working', args=[], kwargs={}, update_interval=0.1, block=True):
-        """Execute the function in a thread and display the message.
+    def changed(self):
+        """Notify the renderer that something needs to be redrawn.
 
-        If block is true, this method blocks until the function returns.
+        Changes are coalesced, so that at most one update happens per frame. Once the IO has been closed, no renderer is started, so changes are only drawn by explicit updates.
         """
-        thread = threading.Thread(target=func, args=args[:], kwargs=kwargs.copy())
+        if self._renderer is None and not self._closed and not getattr(self._local, 'rendering', False): # a renderer which is being stopped must not start another one
+            with self._renderer_lock:
+                if self._renderer is None and not self._closed:
+                    self._renderer = threading.Thread(target=self._render, name='fancyio renderer', daemon=True)
+                    self._renderer.start()
+                    _rendering.add(self)
+        self._changed.set()
+
+    def do(self, func, message='working', args=[], kwargs={}, update_interval=0.1, block=True, executor=None, report=False):
+        """Execute the function in a thread and display the message. Returns the TaskLine.
+
+        If block is true, this method blocks until the function returns. The update_interval argument is ignored, see the IO constructor instead.
+
+        If executor is given, the function is submitted to it (e.g. a concurrent.futures.ThreadPoolExecutor or ProcessPoolExecutor) instead of running in a new thread. The future is available as the thread.future attribute of the returned line. Either way, the line shows FAIL if the function raises an exception.
+
+        If report is true, the function is called with an additional keyword argument reporter, a Reporter which can be used to report progress, even from another process.
+        """
+        kwargs = kwargs.copy()
+        reporter = None
+        if report:
+            reporter = self._reporter(executor)
+            kwargs['reporter'] = reporter
+        if executor is None:
+            thread = _TaskThread(target=func, args=args[:], kwargs=kwargs)
+        else:
+            thread = _FutureTask(executor, func, args[:], kwargs)
         line = TaskLine(self, thread=thread, message=message)
+        if reporter is not None:
+            reporter._task = thread
+            reporter._line = line
+            if reporter._channel is not None:
+                self._reporting[reporter._key] = reporter
         line.start()
         if block:
             self.activate(line)
-            line.join(update_interval=update_interval)
-        else:
-            threading.Thread(target=line.join, kwargs={'update_interval': update_interval}).start()
+            line.join()
+        return line
+
+    @contextlib.contextmanager
+    def frame(self):
+        """Collect everything written inside the with block and write it to the terminal in a single call at the end.
+
+        Nested frames are merged into the outermost one. Frames are per thread, so what other threads write meanwhile isn't collected.
+        """
+        if self._frame is not None:
+            yield
+            return
+        self._frame = []
+        try:
+            yield
+        finally:
+            frame, self._frame = ''.join(self._frame), None
+            if len(frame) > 0:
+                self._write(frame)
 
     def getch(self):
-        return next(self._getch)
+        """Returns the next key event from stdin.
+        """
+        keys = self.read_keys()
+        self.unread(keys[1:])
+        return keys[0]
 
     def index(self, line):
         return self.lines.index(line)
@@ -450,47 +1771,896 @@ class IO:
 
     def insert(self, position, line):
         self.lines.insert(position, line)
-        self.update()
+        self._line_changed(line)
+
+    def listen(self, address):
+        """Display the lines of RemoteIO objects which connect to the Unix socket at the given path, e.g. from worker processes.
+
+        The lines of each RemoteIO are displayed as a block, which is added after the existing lines when it connects. Its lines are updated as they change, and redrawn at most max_fps times per second like any other line. All connections are handled by a single thread, which stops when this IO is closed.
+        """
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(address)
+        server.listen()
+        self._compositor_wakeup, wakeup = socket.socketpair()
+        self._compositor = threading.Thread(target=self._composite, args=(server, address, wakeup), name='fancyio compositor', daemon=True)
+        self._compositor.start()
+
+    def map(self, func, iterable, message='working', executor=None, max_workers=None, report=False, group=False, slow=None):
+        """Call the function on each item of the iterable using the executor, displaying a TaskLine for each call. Blocks until all calls have finished, then returns a list of the results, in order.
+
+        If no executor is given, a concurrent.futures.ThreadPoolExecutor with max_workers workers is used. The message may be a function, in which case it is called with each item to get that item's message. See IO.do for the report argument.
+
+        If group is true, a single TaskGroupLine is displayed instead of a TaskLine for each call. If group is a string, it is used as the message of the group line. Failed calls, as well as calls which have been running for more than slow seconds, get their own line below it.
+        """
+        if executor is None:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return self.map(func, iterable, message=message, executor=executor, report=report, group=group, slow=slow)
+        if group:
+            items = list(iterable)
+            line = TaskGroupLine(self, total=len(items), message=group if isinstance(group, str) else 'working', slow=slow)
+            for item in items:
+                kwargs = {}
+                if report:
+                    reporter = self._reporter(executor)
+                    kwargs['reporter'] = reporter
+                index = line.add(executor.submit(func, item, **kwargs), label=message(item) if callable(message) else message)
+                if report:
+                    reporter._task = _GroupSlot(line, index)
+                    if reporter._channel is not None:
+                        self._reporting[reporter._key] = reporter
+                        line._keys[index] = reporter._key
+            self.watch(line)
+            concurrent.futures.wait(line.futures)
+            line.poll()
+            return [future.result() for future in line.futures]
+        lines = [
+            self.do(func, message=message(item) if callable(message) else message, args=[item], block=False, executor=executor, report=report)
+            for item in iterable
+        ]
+        for line in lines:
+            line.join()
+        return [line.thread.future.result() for line in lines]
+
+    def move_x(self, x):
+        """Returns the escape sequence for moving the cursor to the given column.
+        """
+        sequence = self._move_x.get(x)
+        if sequence is None:
+            sequence = self._move_x[x] = str(self.terminal.move_x(x))
+            self._columns[sequence] = x
+        return sequence
 
     def move_down(self):
-        print(flush=True)
+        self.write('\n')
         self.position += 1
         if self.position == self.max_lines:
             self.max_lines += 1
 
     def move_up(self):
-        if self.position <= 0 or self.max_lines - self.position >= self.terminal.height:
+        if self.position <= 0 or self.max_lines - self.position >= self.height:
             raise IndexError()
         else:
             self.position -= 1
-            print(self.terminal.move_up, end='', flush=True)
+            self.write(self.caps['move_up'])
 
-    def print(self, *args, sep=' ', end='\n', file=None, flush=False, prefix='**'):
+    def read_keys(self):
+        """Returns a list of all key events which are available on stdin, blocking until there is at least one.
+
+        Key events are single characters, complete escape sequences, or text pasted using bracketed paste.
+        """
+        if len(self._unread) > 0:
+            keys, self._unread = self._unread, []
+            return keys
+        return next(self._keys)
+
+    def print(self, *args, sep=' ', end='\n', file=None, flush=False, prefix='**', wrap=False):
         """Print the values to a new StringLine after the existing lines.
 
-        Designed to be compatible with the built-in function "print". However, all keyword arguments other than "sep" and "prefix" are ignored.
+        Designed to be compatible with the built-in function "print". However, all keyword arguments other than "sep", "prefix" and "wrap" are ignored. If wrap is true, the line is wrapped across multiple rows instead of being cut off if it doesn't fit on screen.
+        """
+        PrefixLine(self, message=sep.join(str(arg) for arg in args), prefix=prefix, wrap=wrap)
+
+    def move_to(self, row):
+        while self.position > row:
+            self.move_up()
+        while self.position < row:
+            self.move_down()
+
+    def style(self, name, text):
+        """Returns the text formatted using the given blessings formatting, e.g. 'bold' or 'black_on_cyan'.
+        """
+        sequence = self._styles.get(name)
+        if sequence is None:
+            sequence = self._styles[name] = str(getattr(self.terminal, name))
+        if len(sequence) == 0:
+            return text
+        return sequence + text + self.caps['normal']
+
+    def unread(self, keys):
+        """Put the key events back, so that they are returned by the next call to read_keys.
+        """
+        self._unread = list(keys) + self._unread
+
+    def watch(self, line):
+        """Poll the progress of the line every update_interval seconds until its poll method returns False.
+
+        Only needed for lines whose progress isn't pushed, see TaskLine.notify.
+        """
+        self._tasks.add(line)
+        self.changed()
+
+    def write(self, text):
+        """Write text and escape sequences to the terminal, or to the current thread's frame if there is one.
+
+        In the streaming modes, nothing is drawn, so this does nothing.
+        """
+        if self.mode != 'terminal':
+            return
+        if self._frame is None:
+            self._write(text)
+        else:
+            self._frame.append(text)
+
+    def _close(self):
+        self._closed = True
+        self.active_line = None
+        if self._compositor is not None:
+            try:
+                self._compositor_wakeup.send(b'\0')
+            except OSError:
+                pass # the compositor has already stopped
+            self._compositor.join()
+            self._compositor_wakeup.close()
+            self._compositor = None
+            self._compositor_wakeup = None
+        if self._listener is not None:
+            self._channel.put(None) # progress reported before this is applied before the final update
+            self._listener.join()
+            self._listener = None
+        self._stop_renderer()
+        with self.frame():
+            self.update()
+            if self.mode == 'terminal':
+                self.move_to(max(self._row(len(self)) - 1, self.max_lines - self.height, 0))
+                self.write(self.move_x(0))
+                if len(self):
+                    self.write('\n')
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+            self._channel = None
+
+    def _composite(self, server, address, wakeup):
+        """Accepts RemoteIO connections on the server socket and applies the lines they send, until a byte is received on the wakeup socket.
+
+        A connection which fails or sends something malformed is dropped, and its lines stop running, without affecting the other connections.
+        """
+        def disconnect(connection):
+            selector.unregister(connection)
+            connection.close()
+            block, _ = blocks.pop(connection)
+            for line in block:
+                line.connected = False
+
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ)
+        selector.register(wakeup, selectors.EVENT_READ)
+        blocks = {} # maps connections to the lines they are displayed in and the data received after the last complete message
+        try:
+            while True:
+                for key, events in selector.select():
+                    if key.fileobj is wakeup:
+                        return
+                    if key.fileobj is server:
+                        connection, _ = server.accept()
+                        selector.register(connection, selectors.EVENT_READ)
+                        blocks[connection] = ([], b'')
+                        continue
+                    connection = key.fileobj
+                    block, buffer = blocks[connection]
+                    try:
+                        data = connection.recv(65536)
+                    except OSError: # e.g. the RemoteIO's process has been killed
+                        disconnect(connection)
+                        continue
+                    if len(data) == 0: # the RemoteIO has been closed
+                        disconnect(connection)
+                        continue
+                    *messages, buffer = (buffer + data).split(b'\n')
+                    blocks[connection] = (block, buffer)
+                    try:
+                        with self.update_lock:
+                            for message in messages:
+                                self._apply_remote(block, json.loads(message.decode('utf-8')))
+                    except Exception:
+                        sys.excepthook(*sys.exc_info()) # report the malformed message, but keep serving the other connections
+                        disconnect(connection)
+                    self.changed()
+        finally:
+            for connection in blocks:
+                connection.close()
+            selector.close()
+            server.close()
+            wakeup.close()
+            os.unlink(address)
+
+    def _apply_remote(self, block, message):
+        """Updates the block of lines of a RemoteIO with a message it sent.
+        """
+        while len(block) > message['count']:
+            del self.lines[self.index(block.pop())]
+        while len(block) < message['count']:
+            line = _RemoteLine(None)
+            self.lines.insert(self.index(block[-1]) + 1 if len(block) > 0 else len(self), line)
+            line.io = self
+            self._line_changed(line)
+            block.append(line)
+        for index, snapshot in message['lines']:
+            line = block[index]
+            line.prefix = snapshot['prefix'] or '    '
+            line.remote_prefix = snapshot['formatted_prefix']
+            line.message = snapshot['message']
+            line.wrap = snapshot['wrap']
+
+    def _compact(self, starting_row):
+        """Moves the finished lines above starting_row into the history. Returns the number of removed rows.
+        """
+        first, _ = self._line_at(starting_row)
+        kept = []
+        removed = 0
+        for line in self.lines[:first]:
+            if line.is_running() or line.is_interactive() or (line.dirty and self.mode != 'terminal'): # in the streaming modes, lines are only compacted once they have been written
+                kept.append(line)
+            else:
+                self.history.append(str(line))
+                removed += self._tall.pop(line, 1)
+        if removed > 0:
+            self.lines[:first] = kept
+            self.max_lines -= removed
+            self.position -= removed
+            self._screen = {row - removed: drawn for row, drawn in self._screen.items()}
+            self._shadow = {row - removed: cells for row, cells in self._shadow.items()}
+        return removed
+
+    def _formatter(self, name):
+        """Returns a function which formats text using style with the given formatting. The same function is returned each time, so that it can be used in render keys.
+        """
+        formatter = self._formatters.get(name)
+        if formatter is None:
+            formatter = self._formatters[name] = functools.partial(self.style, name)
+        return formatter
+
+    def _lay_out(self, line):
+        """Lays out the line for the current terminal. Returns its number of rows.
+        """
+        rows = len(line.layout()) if _draws_rows(type(line)) else 1
+        if rows > 1:
+            self._tall[line] = rows
+        else:
+            self._tall.pop(line, None)
+        return rows
+
+    def _line_at(self, row):
+        """Returns the index of the line which takes up the given row, and which of the line's rows it is.
+        """
+        offset = 0
+        for index, rows in self._tall_lines():
+            start = index + offset
+            if row < start:
+                break
+            if row < start + rows:
+                return index, row - start
+            offset += rows - 1
+        return row - offset, 0
+
+    def _row(self, index):
+        """Returns the first row of the line at the given index.
+        """
+        return index + sum(rows - 1 for position, rows in self._tall_lines() if position < index)
+
+    def _tall_lines(self):
+        """Returns the indices and numbers of rows of the lines which took up more than one row when they were last laid out, in order. Lines which have been removed are forgotten.
+        """
+        tall = []
+        for line, rows in list(self._tall.items()):
+            if line in self.lines:
+                tall.append((self.index(line), rows))
+            else:
+                del self._tall[line]
+        return sorted(tall)
+
+    def _next_interactive(self, down):
+        """Returns the closest interactive line below (or above) the active line, or None if there is none.
+        """
+        if down:
+            current = -1 if self.active_line is None else self.index(self.active_line)
+            for position, line in self.lines.interactive():
+                if position > current:
+                    return line
+        else:
+            current = len(self) if self.active_line is None else self.index(self.active_line)
+            for position, line in reversed(self.lines.interactive()):
+                if position < current:
+                    return line
+
+    def _line_changed(self, line):
+        """Called when the line has been added or has changed, see Line.changed. In the streaming modes, it is remembered for the next update.
+        """
+        if self.mode != 'terminal':
+            self._stream_pending[line] = None
+        self.changed()
+
+    def _listen(self, channel):
+        """Applies the progress reported from other processes as it arrives, until None is received.
+        """
+        while True:
+            message = channel.get()
+            if message is None:
+                return
+            key, attr, value = message
+            reporter = self._reporting.get(key)
+            if reporter is not None:
+                reporter._apply(attr, value)
+
+    def _poll_tasks(self):
+        for line in self._tasks.copy():
+            if not line.poll():
+                self._tasks.discard(line)
+
+    def _reporter(self, executor):
+        if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            return Reporter(channel=self._process_channel(), key=next(self._report_keys))
+        return Reporter()
+
+    def _process_channel(self):
+        """Returns a queue which can be passed to other processes to report progress back to this IO.
         """
-        PrefixLine(self, message=sep.join(str(arg) for arg in args), prefix=prefix)
+        if self._channel is None:
+            self._manager = multiprocessing.Manager()
+            self._channel = self._manager.Queue()
+            self._listener = threading.Thread(target=self._listen, args=(self._channel,), name='fancyio progress listener', daemon=True)
+            self._listener.start()
+        return self._channel
+
+    def _on_resize(self, *args):
+        """Handles SIGWINCH. Only sets flags, since it may interrupt the main thread while it holds locks, e.g. while stopping the renderer. If the renderer isn't running, the new size is picked up by the next update.
+        """
+        self._resized = True
+        self._changed.set()
+        if callable(self._old_sigwinch):
+            self._old_sigwinch(*args)
+
+    def _refresh_terminal(self):
+        """Capture the terminal's size and escape sequences.
+        """
+        self.width = self.terminal.width or 80 # blessings returns None if the size is unknown, e.g. when not writing to a terminal
+        self.height = self.terminal.height or 24
+        self.caps = {name: str(getattr(self.terminal, name)) for name in ('clear_eol', 'clear_eos', 'move_up', 'normal')}
+        self._move_x = {}
+        self._columns = {} # the inverse of _move_x
+        self._styles = {}
+        self.ellipsis = self.style('black_on_cyan', '...')
+        self._caps_version += 1
+
+    def _render(self):
+        self._local.rendering = True
+        while True:
+            self._changed.wait(self.update_interval if len(self._tasks) > 0 else None)
+            if self._renderer is not threading.current_thread():
+                return # the renderer has been stopped
+            self._changed.clear()
+            start = time.monotonic()
+            try:
+                self._poll_tasks()
+                self.update()
+            except Exception:
+                sys.excepthook(*sys.exc_info()) # report the error but keep rendering, so that later changes are still drawn
+            if self.max_fps is not None:
+                time.sleep(max(0, start + 1 / self.max_fps - time.monotonic()))
+
+    def _stop_renderer(self):
+        with self._renderer_lock:
+            renderer, self._renderer = self._renderer, None
+        if renderer is not None: # not joined while holding the lock, since the renderer may need it if it changes a line before it stops
+            self._changed.set()
+            if renderer is not threading.current_thread():
+                renderer.join()
+        self._poll_tasks()
+
+    def _sleeper(self, delta):
+        return _Sleep(self._scheduler, delta)
+
+    def _write(self, text):
+        stream = sys.stdout if self.stream is None else self.stream
+        stream.write(text)
+        stream.flush()
+        if self.stats is not None:
+            self.stats.writes += 1
+            self.stats.bytes += len(text.encode('utf-8'))
 
     def update(self):
+        """Redraw the lines which have changed since the last update.
+
+        A line is redrawn if it is marked as dirty or if a different line was previously drawn in its row, e.g. because lines were inserted or deleted. Everything is redrawn when the terminal is resized.
+        """
+        update = self._update if self.mode == 'terminal' else self._update_stream
+        if self.stats is None:
+            with self.update_lock, self.frame():
+                update()
+            return
+        wait_start = time.perf_counter()
         with self.update_lock:
-            self.max_lines = max(self.max_lines, len(self))
-            starting_line = 0
-            if self.max_lines > self.terminal.height:
-                starting_line = self.max_lines - self.terminal.height
-            while self.position > starting_line:
-                self.move_up()
-            if len(self) > starting_line:
-                for line in self.lines[starting_line:-1]:
-                    line.io = self
-                    line.draw()
-                    self.move_down()
-                self.lines[-1].draw()
+            start = time.perf_counter()
+            with self.frame():
+                drawn = update()
+            end = time.perf_counter()
+            self.stats.updates += 1
+            self.stats.lock_wait += start - wait_start
+            self.stats.lock_held += end - start
+            self.stats.lines_drawn += drawn
+        if self.stats.callback is not None:
+            self.stats.callback(self.stats)
+
+    def _diff(self, row, text):
+        """Returns what needs to be written to change the row the cursor is on from what was last drawn there to the text, and remembers the text as drawn there.
+
+        Rows are compared cell by cell, so that only the span which has changed is written, e.g. just the prefix of a task line while its progress bar advances. Text which can't be parsed into cells is written in full.
+        """
+        old = self._shadow.get(row)
+        new = self._parse_row(text)
+        if new is None:
+            self._shadow.pop(row, None)
+            return text
+        self._shadow[row] = new
+        if old is None:
+            return text
+        old_cells, _, _ = old
+        cells, _, cursor = new
+        start = 0
+        while start < len(cells) and start < len(old_cells) and cells[start] == old_cells[start]:
+            start += 1
+        end = len(cells)
+        old_width = sum(width for formatting, char, width in old_cells)
+        new_width = sum(width for formatting, char, width in cells)
+        if new_width == old_width: # the unchanged end of the row is still in the same columns
+            old_end = len(old_cells)
+            while end > start and old_end > start and cells[end - 1] == old_cells[old_end - 1]:
+                end -= 1
+                old_end -= 1
+        result = []
+        if start < end or new_width < old_width:
+            result.append(self.move_x(sum(width for formatting, char, width in cells[:start])))
+            current = ''
+            for formatting, char, width in cells[start:end]:
+                if formatting != current:
+                    result.append((self.caps['normal'] if current else '') + formatting)
+                    current = formatting
+                result.append(char)
+            if current:
+                result.append(self.caps['normal'])
+            if new_width < old_width:
+                result.append(self.caps['clear_eol'])
+        if cursor is not None:
+            result.append(self.move_x(cursor))
+        return ''.join(result)
+
+    def _draw(self, line, part, row):
+        draw = functools.partial(line.draw, part) if _draws_rows(type(line)) else line.draw
+        frame, self._frame = self._frame, [] # capture the output, so that it can be compared to what is on screen
+        try:
+            if self.stats is None:
+                draw()
             else:
-                print(self.terminal.move_x(0) + self.terminal.clear_eol, end='', flush=True)
-            if self.position < self.max_lines - 1:
-                print(self.terminal.move_down + self.terminal.move_x(0) + self.terminal.clear_eos + self.terminal.move_up, end='', flush=True)
-            if self.active_line is not None and self.active_line in self:
-                while self.position > self.index(self.active_line):
-                    self.move_up()
-                self.active_line.draw()
+                start = time.perf_counter()
+                draw()
+                name = type(line).__name__
+                self.stats.draw_time[name] = self.stats.draw_time.get(name, 0.0) + time.perf_counter() - start
+                self.stats.draw_count[name] = self.stats.draw_count.get(name, 0) + 1
+        finally:
+            text, self._frame = ''.join(self._frame), frame
+        self.write(self._diff(row, text))
+
+    def _parse_row(self, text):
+        """Splits text which draws a row into cells. Returns a tuple of the cells as (formatting, character, width) triples, whether the rest of the row is cleared, and the column the cursor is moved to at the end, if any.
+
+        Returns None if the text doesn't start by moving to the first column, or contains escape sequences other than formatting, clear_eol and moving to a column at the end.
+        """
+        chunks = _chunks(text)
+        if next(chunks, None) != (self.move_x(0), 0):
+            return None
+        cells = []
+        formatting = ''
+        clear = False
+        cursor = None
+        for chunk, width in chunks:
+            if cursor is not None:
+                return None
+            if chunk == self.caps['clear_eol']:
+                clear = True
+            elif chunk in self._columns:
+                cursor = self._columns[chunk]
+            elif _FORMATTING.fullmatch(chunk):
+                formatting = '' if chunk in ('\x1b[m', '\x1b[0m') else formatting + chunk
+            elif clear or chunk.startswith('\x1b') or unicodedata.category(chunk) == 'Cc':
+                return None
+            elif width == 0:
+                if len(cells) == 0:
+                    return None
+                cells[-1] = (cells[-1][0], cells[-1][1] + chunk, cells[-1][2]) # combining character
+            else:
+                cells.append((formatting, chunk, width))
+        return tuple(cells), clear, cursor
+
+    def _update(self):
+        """Does the work of update while holding the lock. Returns the number of rows drawn.
+
+        Rows are counted separately from lines, since lines may take up more than one row.
+        """
+        if self._resized or (not self._watching_resize and (self.terminal.width or 80, self.terminal.height or 24) != (self.width, self.height)): # with the same fallback as _refresh_terminal, so that an unknown size doesn't count as a resize
+            self._resized = False
+            self._refresh_terminal()
+        size = (self.width, self.height)
+        resized = size != self._size
+        if resized:
+            self._size = size
+            self._screen = {}
+            self._shadow = {}
+        first, _ = self._line_at(max(max(self.max_lines, self._row(len(self))) - self.height, 0)) # based on the rows of the lines as last laid out
+        for line in self.lines[first:]: # lay out the changed lines which may be on screen, since their number of rows decides which rows are on screen
+            if line.dirty or resized:
+                line.io = self
+                self._lay_out(line)
+        self.max_lines = max(self.max_lines, self._row(len(self)))
+        drawn = 0
+        starting_row = 0
+        if self.max_lines > self.height:
+            starting_row = self.max_lines - self.height
+            if self.scrollback is not None:
+                starting_row -= self._compact(starting_row)
+        for row in [row for row in self._screen if row < starting_row]:
+            del self._screen[row] # scrolled out of screen
+        for row in [row for row in self._shadow if row < starting_row]:
+            del self._shadow[row]
+        index, part = self._line_at(starting_row)
+        row = starting_row - part
+        for index in range(index, len(self)):
+            line = self.lines[index]
+            rows = self._tall.get(line, 1)
+            if line.dirty or any(self._screen.get(row + part) != (line, part) for part in range(rows) if row + part >= starting_row):
+                line.io = self
+                line.dirty = False
+                rows = self._lay_out(line)
+                for part in range(rows):
+                    if row + part >= starting_row:
+                        self.move_to(row + part)
+                        self._draw(line, part, row + part)
+                        drawn += 1
+                        self._screen[row + part] = (line, part)
+            row += rows
+        stale_rows = [stale_row for stale_row in self._screen if stale_row >= row]
+        if len(stale_rows) > 0 or (resized and row < self.max_lines):
+            self.move_to(max(row, starting_row))
+            self.write(self.move_x(0) + self.caps['clear_eos'])
+            for stale_row in stale_rows:
+                del self._screen[stale_row]
+            for cleared_row in self._shadow:
+                if cleared_row >= max(row, starting_row):
+                    self._shadow[cleared_row] = ((), True, None)
+        if self.active_line is not None and self.active_line in self:
+            active_row = self._row(self.index(self.active_line))
+            self.move_to(active_row)
+            self.active_line.dirty = False
+            self._draw(self.active_line, 0, active_row)
+            drawn += 1
+        return drawn
+
+    def _update_stream(self):
+        """Does the work of update in the streaming modes, appending the lines whose stream_event has changed. Returns the number of lines written.
+
+        Only the lines which have changed since the last update are looked at, see _line_changed. If scrollback is not None, the finished lines which are followed by more lines than fit on screen are moved into the history afterwards.
+        """
+        pending = []
+        while len(self._stream_pending) > 0: # popitem is atomic, so lines can keep being added from other threads
+            pending.append(self._stream_pending.popitem()[0])
+        written = 0
+        for index, line in sorted((self.index(line), line) for line in pending if line in self.lines):
+            if not line.dirty:
+                continue
+            line.io = self
+            line.dirty = False
+            event = line.stream_event()
+            if event is None or event == line.__dict__.get('_stream_event'):
+                continue
+            line._stream_event = event
+            if self.mode == 'json':
+                if '_stream_id' not in line.__dict__:
+                    line._stream_id = next(self._stream_ids)
+                record = {'time': time.time(), 'id': line._stream_id, 'type': type(line).__name__, 'event': event, 'text': str(line)}
+                self._frame.append(json.dumps(record) + '\n')
+            else:
+                self._frame.append(str(line) + '\n')
+            written += 1
+        if self.scrollback is not None and len(self) > self.height:
+            self._compact(len(self) - self.height)
+        return written
+
+class AsyncIO(IO):
+    """An IO object for use with asyncio.
+
+    Use it as an async context manager from within a running event loop. Redraws and progress polling are driven by loop timers instead of a renderer thread. Only while input is being read, the tty is in raw mode and stdin is read using loop.add_reader, unless it is a regular file or /dev/null, so that Ctrl-C interrupts the program the rest of the time. The methods for activating lines, reading input, running tasks and sleeping are coroutines.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loop = None
+        self._decoder = None
+        self._flush_handle = None
+        self._frame_handle = None
+        self._frame_requested = False
+        self._last_frame = 0.0
+        self._old_settings = None
+        self._reading = False # whether stdin is being read, see _start_reading
+        self._reading_stdin = False # whether stdin is read using loop.add_reader, see read_keys
+
+    async def __aenter__(self):
+        self._closed = False
+        self._loop = asyncio.get_running_loop()
+        self._keys = asyncio.Queue()
+        self._decoder = _KeyDecoder(sys.stdin.encoding or 'utf-8')
+        self._loop.add_signal_handler(signal.SIGWINCH, self._on_resize)
+        self._watching_resize = True
+        return self
+
+    async def __aexit__(self, exception_type, exception_val, trace):
+        self._stop_reading()
+        self._loop.remove_signal_handler(signal.SIGWINCH)
+        self._watching_resize = False
+        self._close()
+        return exception_type is None # re-raise any exceptions
+
+    async def activate(self, line):
+        if (line is None) or (line in self):
+            self.active_line = line
+            self.changed()
+            if line is not None:
+                if line.is_interactive():
+                    started = self._start_reading()
+                    try:
+                        await line.activate_async()
+                    finally:
+                        if started:
+                            self._stop_reading()
+                await self.activate(None)
+        else:
+            raise ValueError()
+
+    async def activate_down(self):
+        prev_active_line = self.active_line
+        line = self._next_interactive(down=True)
+        if line is None:
+            return False
+        await self.activate(line)
+        self.active_line = prev_active_line
+        return True
+
+    async def activate_up(self):
+        prev_active_line = self.active_line
+        line = self._next_interactive(down=False)
+        if line is None:
+            return False
+        await self.activate(line)
+        self.active_line = prev_active_line
+        return True
+
+    def changed(self):
+        if self._loop is None or self._frame_requested:
+            return # not entered yet, or a frame is already coming up
+        self._frame_requested = True
+        self._loop.call_soon_threadsafe(self._schedule_frame)
+
+    async def do(self, awaitable, message='working', args=[], kwargs={}, report=False):
+        """Await the coroutine or other awaitable and display the message. Returns the awaitable's result.
+
+        The awaitable may also be a coroutine function, which is called with args and kwargs. If report is true, it is called with an additional keyword argument reporter, a Reporter which can be used to report progress, like the function passed to IO.do. Otherwise, if the awaitable has progress or state attributes, they are polled like those of a thread passed to TaskLine.
+        """
+        reporter = None
+        if callable(awaitable):
+            kwargs = kwargs.copy()
+            if report:
+                reporter = Reporter()
+                kwargs['reporter'] = reporter
+            awaitable = awaitable(*args, **kwargs)
+        elif report:
+            raise TypeError('report=True requires a coroutine function')
+        task = _AsyncTask(awaitable)
+        line = TaskLine(self, thread=task, message=message)
+        if reporter is not None:
+            reporter._task = task
+            reporter._line = line
+        line.start()
+        await self.activate(line)
+        try:
+            result = await task.task
+        except BaseException:
+            line.update_progress(state='FAIL')
+            raise
+        line.update_progress(progress=1.0)
+        return result
+
+    async def getch(self):
+        keys = await self.read_keys()
+        self.unread(keys[1:])
+        return keys[0]
+
+    async def input(self, prompt='', prefix='????'):
+        """Display the prompt and wait for newline-terminated input on stdin.
+        """
+        line = InputLine(self, message=prompt, prefix=prefix)
+        await self.activate(line)
+        return await line.join_async()
+
+    async def map(self, func, iterable, message='working', report=False):
+        """Await the coroutine function called on each item of the iterable, all at once, displaying a TaskLine for each call. Returns a list of the results, in order.
+
+        The message may be a function, in which case it is called with each item to get that item's message. See AsyncIO.do for the report argument.
+        """
+        return await asyncio.gather(*(
+            self.do(func, message=message(item) if callable(message) else message, args=[item], report=report)
+            for item in iterable
+        ))
+
+    async def sleep(self, end, message=None):
+        """Sleep until the given datetime.datetime, or for the given number of seconds or datetime.timedelta, and display a SleepLine.
+        """
+        line = SleepLine(self, end, message=message)
+        line.start()
+        await line.thread.task
+        line.update_progress(progress=1.0)
+
+    async def read_keys(self):
+        if len(self._unread) > 0:
+            keys, self._unread = self._unread, []
+            return keys
+        started = self._start_reading()
+        try:
+            while not self._reading_stdin and self._keys.empty() and self._flush_handle is None:
+                self._read_stdin()
+            keys = await self._keys.get()
+        finally:
+            if started:
+                self._stop_reading()
+        while not self._keys.empty():
+            keys += self._keys.get_nowait()
+        return keys
+
+    def _flush_keys(self):
+        self._flush_handle = None
+        keys = self._decoder.flush()
+        if len(keys) > 0:
+            self._keys.put_nowait(keys)
+
+    def _on_resize(self):
+        self._resized = True # called from the event loop rather than as a signal handler, so it can schedule a frame
+        self.changed()
+
+    def _read_stdin(self):
+        data = os.read(sys.stdin.fileno(), 4096)
+        if len(data) == 0: # end of file
+            if self._reading_stdin:
+                self._loop.remove_reader(sys.stdin.fileno())
+                self._reading_stdin = False # further reads return the end of file right away
+            keys = ['\x04']
+        else:
+            keys = self._decoder.feed(data)
+        if len(keys) > 0:
+            self._keys.put_nowait(keys)
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._decoder.pending:
+            self._flush_handle = self._loop.call_later(_ESCAPE_TIMEOUT, self._flush_keys)
+
+    def _start_reading(self):
+        """Puts the tty into raw mode and starts reading stdin, unless that has already been done. Returns whether it has been done now.
+        """
+        if self._reading:
+            return False
+        self._reading = True
+        fd = sys.stdin.fileno()
+        if os.isatty(fd):
+            self._old_settings = termios.tcgetattr(fd)
+            tty.setraw(fd)
+        try:
+            self._loop.add_reader(fd, self._read_stdin)
+            self._reading_stdin = True
+        except PermissionError:
+            pass # stdin is a regular file or /dev/null, which can't be waited for but doesn't block either, see read_keys
+        return True
+
+    def _stop_reading(self):
+        """Undoes _start_reading, so that the tty handles Ctrl-C and other keys as usual again.
+        """
+        if not self._reading:
+            return
+        self._reading = False
+        fd = sys.stdin.fileno()
+        if self._reading_stdin:
+            self._loop.remove_reader(fd)
+            self._reading_stdin = False
+        if self._old_settings is not None:
+            termios.tcsetattr(fd, termios.TCSADRAIN, self._old_settings)
+            self._old_settings = None
+
+    def _render_frame(self):
+        self._frame_handle = None
+        self._frame_requested = False
+        self._last_frame = self._loop.time()
+        self._poll_tasks()
+        self.update()
+        if len(self._tasks) > 0 and self._frame_handle is None:
+            self._frame_handle = self._loop.call_later(self.update_interval, self._render_frame)
+
+    def _schedule_frame(self):
+        if self._frame_handle is None:
+            delay = 0 if self.max_fps is None else max(0, self._last_frame + 1 / self.max_fps - self._loop.time())
+            self._frame_handle = self._loop.call_later(delay, self._render_frame)
+
+    def _sleeper(self, delta):
+        return _AsyncTask(_AsyncSleep(delta))
+
+    def _stop_renderer(self):
+        if self._frame_handle is not None:
+            self._frame_handle.cancel()
+            self._frame_handle = None
+        self._poll_tasks()
+
+class RemoteIO(IO):
+    """An IO object which sends its lines to an IO in another process (or thread) instead of drawing them, so that many processes can share one terminal.
+
+    The other IO must be listening on the Unix socket at the given path, see IO.listen. It displays the lines of each RemoteIO as a block. Lines are sent at most max_fps times per second, and only those which have changed. If the other IO goes away, nothing is sent anymore. Input is not supported.
+    """
+    def __init__(self, address, terminal=None, max_fps=30, update_interval=0.1, stats=None):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(address)
+        self._sent = [] # the lines as of the last update
+        super().__init__(terminal=terminal, max_fps=max_fps, update_interval=update_interval, stats=stats, mode='stream')
+
+    def _close(self):
+        super()._close()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _snapshot(self, line):
+        if isinstance(line, PrefixLine):
+            return {'prefix': line.prefix, 'formatted_prefix': line.formatted_prefix(), 'message': line.message, 'wrap': line.wrap}
+        return {'prefix': None, 'formatted_prefix': None, 'message': str(line), 'wrap': getattr(line, 'wrap', False)}
+
+    def _update_stream(self):
+        """Sends the lines which have changed since the last update, or which have moved. Returns the number of lines sent.
+        """
+        self._stream_pending.clear() # the lines are compared with those sent instead
+        lines = list(self.lines)
+        changed = []
+        for index, line in enumerate(lines):
+            if line.dirty or index >= len(self._sent) or self._sent[index] is not line:
+                line.io = self
+                line.dirty = False
+                changed.append([index, self._snapshot(line)])
+        if len(changed) > 0 or len(lines) != len(self._sent):
+            self._frame.append(json.dumps({'count': len(lines), 'lines': changed}) + '\n')
+        self._sent = lines
+        return len(changed)
+
+    def _write(self, text):
+        if self._socket is None:
+            return # the listening IO has gone away
+        data = text.encode('utf-8')
+        try:
+            self._socket.sendall(data)
+        except OSError: # e.g. BrokenPipeError once the listening IO has been closed
+            self._socket.close()
+            self._socket = None
+            return
+        if self.stats is not None:
+            self.stats.writes += 1
+            self.stats.bytes += len(data)
@@ -0,0 +1,670 @@
+"""Tests for fancyio. The tests which check what ends up on screen feed the output to pyte, a terminal emulator, and are skipped if it isn't installed.
+"""
+
+import sys
+
+import asyncio
+import concurrent.futures
+import io
+import os
+import pty
+import random
+import signal
+import socket
+import subprocess
+import termios
+import threading
+import time
+
+import pytest
+
+import fancyio
+from benchmark import FakeTerminal
+
+class Screen:
+    """An output stream which feeds everything written to it to a pyte screen.
+    """
+    def __init__(self, width, height):
+        pyte = pytest.importorskip('pyte')
+        self.screen = pyte.Screen(width, height)
+        self.stream = pyte.Stream(self.screen)
+        self.written = []
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return True
+
+    def rows(self):
+        """Returns the text of each row, without trailing spaces.
+        """
+        return [row.rstrip() for row in self.screen.display]
+
+    def write(self, text):
+        self.written.append(text)
+        self.stream.feed(text)
+        return len(text)
+
+def wait_until(condition, timeout=5):
+    """Waits for the renderer thread to make the condition true. Returns whether it did.
+    """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+@pytest.fixture
+def terminal():
+    """Returns a function which creates an IO drawing to a pyte screen of the given size, and returns both. The IOs are closed after the test.
+    """
+    ios = []
+
+    def make(width=40, height=10, **kwargs):
+        screen = Screen(width, height)
+        io = fancyio.IO(FakeTerminal(width, height), stream=screen, max_fps=None, **kwargs)
+        ios.append(io)
+        return io, screen
+
+    yield make
+    for io in ios:
+        io._stop_renderer()
+
+def test_changes_drawn_while_notifying():
+    class EagerIO(fancyio.IO):
+        def changed(self):
+            self.update() # draw right away, like a renderer thread which is faster than the thread making the change
+
+    screen = Screen(20, 4)
+    io = EagerIO(FakeTerminal(20, 4), stream=screen)
+    line = fancyio.StringLine(io, 'old')
+    line.message = 'new'
+    assert screen.rows()[0] == 'new'
+
+def test_changes_drawn_at_exit():
+    script = 'import time, fancyio, benchmark; io = fancyio.IO(benchmark.FakeTerminal(), mode="stream", max_fps=2); io.print("first"); time.sleep(0.1); io.print("last")'
+    result = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE, universal_newlines=True, timeout=10)
+    assert result.stdout == '[ ** ] first\n[ ** ] last\n'
+
+def test_renderer_survives_errors(terminal, monkeypatch):
+    class FlakyLine(fancyio.StringLine):
+        def render_rows(self):
+            if len(errors) == 0:
+                raise RuntimeError('flaky')
+            return super().render_rows()
+
+    errors = []
+    monkeypatch.setattr(sys, 'excepthook', lambda exception_type, exception, trace: errors.append(exception))
+    io, screen = terminal(20, 4)
+    FlakyLine(io, 'flaky')
+    assert wait_until(lambda: len(errors) > 0)
+    io.print('fine')
+    assert wait_until(lambda: screen.rows()[:2] == ['flaky', '[ ** ] fine'])
+
+def test_close_while_polling(terminal):
+    class PolledLine(fancyio.StringLine):
+        def poll(self):
+            polling.set()
+            time.sleep(0.1) # until the renderer is being stopped
+            self.message = str(time.monotonic())
+            return True
+
+    polling = threading.Event()
+    io, screen = terminal()
+    io.watch(PolledLine(io))
+    assert polling.wait(5)
+    thread = threading.Thread(target=io._close, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert io._renderer is None
+
+def test_nothing_drawn_after_close(terminal):
+    class Ticking:
+        """A thread whose progress changes whenever it is read, so that its line changes each time it is drawn.
+        """
+        ticks = 0
+
+        def is_alive(self):
+            return True
+
+        @property
+        def progress(self):
+            self.ticks += 1
+            return self.ticks % 5 / 5
+
+    io, screen = terminal()
+    fancyio.StatsLine(io)
+    fancyio.TaskLine(io, Ticking(), 'ticking')
+    io._close()
+    written = len(screen.written)
+    time.sleep(0.2)
+    assert io._renderer is None
+    assert len(screen.written) == written
+
+def test_render_stats(terminal):
+    updates = []
+    stats = fancyio.RenderStats(callback=lambda stats: updates.append(stats.updates))
+    io, screen = terminal(stats=stats)
+    stats_line = fancyio.StatsLine(io)
+    for i in range(3):
+        io.print('line', i)
+    io._close()
+    assert stats.updates > 0
+    assert updates == list(range(1, stats.updates + 1))
+    assert stats.writes == len(screen.written)
+    assert stats.bytes == sum(len(text.encode('utf-8')) for text in screen.written)
+    assert screen.rows()[0].startswith('[stat] ')
+    assert stats_line not in io._tasks # not polled anymore once closed
+
+def test_frames_are_per_thread():
+    stream = io.StringIO()
+    terminal_io = fancyio.IO(FakeTerminal(), stream=stream, mode='terminal')
+    with terminal_io.frame():
+        terminal_io.write('frame')
+        thread = threading.Thread(target=terminal_io.write, args=['bell'])
+        thread.start()
+        thread.join()
+        assert stream.getvalue() == 'bell'
+    assert stream.getvalue() == 'bellframe'
+
+def test_wrapped_line_getting_shorter(terminal):
+    io, screen = terminal(20, 4)
+    with io.update_lock: # keep the renderer from drawing in between
+        fancyio.StringLine(io, 'b')
+        line = fancyio.StringLine(io, 'x' * 30, wrap=True)
+    io.update()
+    with io.update_lock:
+        line.message = 'b'
+        fancyio.StringLine(io, 'b')
+        fancyio.StringLine(io, 'a')
+    io.update()
+    assert io.max_lines == 4
+    assert screen.rows() == ['b', 'b', 'b', 'a']
+
+def test_draw_without_row(terminal):
+    class LegacyLine(fancyio.StringLine):
+        def draw(self):
+            self.io.write(self.io.move_x(0) + 'legacy ' + self.message[:10] + self.io.caps['clear_eol'])
+
+    io, screen = terminal(20, 4)
+    LegacyLine(io, 'x' * 30, wrap=True)
+    io.print('after')
+    io.update()
+    assert screen.rows()[:2] == ['legacy xxxxxxxxxx', '[ ** ] after']
+
+def test_unknown_terminal_size():
+    terminal_io = fancyio.IO(FakeTerminal(None, None), stream=io.StringIO(), mode='terminal')
+    version = terminal_io._caps_version
+    terminal_io.print('line')
+    terminal_io.update()
+    terminal_io.update()
+    terminal_io._close()
+    assert (terminal_io.width, terminal_io.height) == (80, 24)
+    assert terminal_io._caps_version == version # the caches of rendered lines are still valid
+
+def test_task_prefix_formatter(terminal):
+    io, screen = terminal()
+    line = io.do(lambda: None, message='done')
+    formatter = line.prefix_formatter
+    line.update_progress(progress=1.0)
+    assert line.prefix_formatter is formatter # unchanged, so the line isn't redrawn
+    assert formatter(' ok ') == io.style('green', ' ok ')
+
+@pytest.fixture
+def stdin(monkeypatch, tmp_path):
+    """Replaces stdin with a regular file containing the given text. Regular files can't be used with loop.add_reader.
+    """
+    files = []
+
+    def replace(text):
+        path = tmp_path / 'stdin'
+        path.write_text(text)
+        files.append(path.open())
+        monkeypatch.setattr(sys, 'stdin', files[-1])
+
+    yield replace
+    for file in files:
+        file.close()
+
+def test_async_input_from_file(stdin):
+    async def ask():
+        async with fancyio.AsyncIO(FakeTerminal(), stream=io.StringIO()) as async_io:
+            return await async_io.input('name? '), await async_io.input('again? ')
+
+    stdin('alice\n')
+    assert asyncio.run(ask()) == ('alice', '')
+
+def test_async_raw_mode_only_while_reading(monkeypatch):
+    def interrupts():
+        return termios.tcgetattr(slave)[3] & termios.ISIG != 0 # whether Ctrl-C sends SIGINT
+
+    def type_name():
+        while_reading.append(interrupts())
+        os.write(master, b'bob\r')
+
+    async def run():
+        async with fancyio.AsyncIO(FakeTerminal(), stream=io.StringIO()) as async_io:
+            await async_io.sleep(0.01)
+            before = interrupts()
+            asyncio.get_running_loop().call_later(0.05, type_name)
+            answer = await async_io.input('name? ')
+            return before, answer, interrupts()
+
+    master, slave = pty.openpty()
+    while_reading = []
+    with os.fdopen(master, 'wb', buffering=0, closefd=True), open(slave, closefd=True) as slave_file:
+        monkeypatch.setattr(sys, 'stdin', slave_file)
+        assert asyncio.run(run()) == (True, 'bob', True)
+    assert while_reading == [False]
+
+def test_async_map_with_reporter(stdin):
+    async def double(item, reporter):
+        reporter.set_progress(0.5)
+        prefixes.append(async_io.lines[item].prefix)
+        await asyncio.sleep(0)
+        return item * 2
+
+    async def run():
+        nonlocal async_io
+        async with fancyio.AsyncIO(FakeTerminal(), stream=io.StringIO()) as async_io:
+            return await async_io.map(double, range(3), report=True)
+
+    stdin('')
+    async_io = None
+    prefixes = []
+    assert asyncio.run(run()) == [0, 2, 4]
+    assert prefixes == ['==..'] * 3
+    assert [line.prefix for line in async_io.lines] == [' ok '] * 3
+
+def test_stream_scrollback():
+    stream = io.StringIO()
+    stream_io = fancyio.IO(FakeTerminal(80, 24), stream=stream, mode='stream', scrollback=10)
+    for i in range(1000):
+        stream_io.print('line', i)
+    stream_io._close()
+    assert stream.getvalue().splitlines() == ['[ ** ] line {}'.format(i) for i in range(1000)]
+    assert len(stream_io.lines) == 24
+    assert list(stream_io.history) == ['[ ** ] line {}'.format(i) for i in range(966, 976)]
+
+def test_paste_with_line_breaks(terminal):
+    io, screen = terminal(40, 4)
+    line = fancyio.InputLine(io, 'json: ')
+    line.feed(fancyio._Paste('{\r\n  "a": 1\r\n}'))
+    assert line.answer == '{   "a": 1 }'
+    io.print('after')
+    io.update()
+    assert screen.rows()[:2] == ['[????] json: {   "a": 1 }', '[ ** ] after']
+
+@pytest.mark.parametrize('pooled', [False, True])
+def test_do_failing(terminal, monkeypatch, pooled):
+    def fail():
+        raise ValueError('failed')
+
+    monkeypatch.setattr(threading, 'excepthook', lambda args: None) # the thread still reports the exception
+    io, screen = terminal()
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        line = io.do(fail, message='failing', executor=executor if pooled else None)
+    assert line.prefix == 'FAIL'
+    assert wait_until(lambda: screen.rows()[0] == '[FAIL] failing')
+
+def test_do_with_executor(terminal):
+    io, screen = terminal()
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        line = io.do(sum, args=[[1, 2]], message='adding', executor=executor)
+    assert line.thread.future.result() == 3
+    assert wait_until(lambda: screen.rows()[0] == '[ ok ] adding')
+
+def test_map(terminal):
+    io, screen = terminal()
+    assert io.map(lambda item: item * 2, range(3), message=lambda item: 'item {}'.format(item), max_workers=2) == [0, 2, 4]
+    assert wait_until(lambda: screen.rows()[:3] == ['[ ok ] item {}'.format(item) for item in range(3)])
+
+def test_reporter_advance(terminal):
+    def work(reporter):
+        reporter.advance(total=4)
+        reporter.advance()
+        advanced.set()
+        finish.wait(5)
+
+    advanced, finish = threading.Event(), threading.Event()
+    io, screen = terminal()
+    line = io.do(work, message='steps', block=False, report=True)
+    assert advanced.wait(5)
+    assert wait_until(lambda: screen.rows()[0] == '[==..] steps')
+    finish.set()
+    line.join()
+    assert wait_until(lambda: screen.rows()[0] == '[ ok ] steps')
+
+def _report_and_wait(path, reporter):
+    """Reports half of the progress, then waits until the file at the path exists. Runs in a worker process.
+    """
+    reporter.set_progress(0.5)
+    deadline = time.monotonic() + 5
+    while not os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return path
+
+def test_process_pool_reporting(terminal, tmp_path):
+    path = str(tmp_path / 'reported')
+    io, screen = terminal()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        line = io.do(_report_and_wait, args=[path], message='in a process', block=False, executor=executor, report=True)
+        assert wait_until(lambda: screen.rows()[0] == '[==..] in a process') # reported through the queue
+        open(path, 'w').close()
+        line.join()
+    assert line.thread.future.result() == path
+    io._close() # shuts down the queue's manager process
+    assert screen.rows()[0] == '[ ok ] in a process'
+
+def test_group_polled_concurrently():
+    class SlowFuture(concurrent.futures.Future):
+        def running(self):
+            time.sleep(0.05) # so that the polls overlap
+            return True
+
+    def poll():
+        group.poll()
+        messages.append(group.message)
+
+    messages = []
+    group = fancyio.TaskGroupLine(None, total=2, message='working')
+    for _ in range(2):
+        group.add(SlowFuture())
+    threads = [threading.Thread(target=poll) for _ in range(2)] # like the renderer and IO.map
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert messages == ['working (0/2 done, 2 running)'] * 2
+
+def test_group_details_moved_into_history(terminal):
+    def work(item):
+        time.sleep(0.4)
+        return item
+
+    def chatter():
+        time.sleep(0.2) # until the tasks are slow and have been expanded
+        for i in range(10):
+            io.print('chatter', i)
+            time.sleep(0.01)
+
+    io, screen = terminal(40, 4, scrollback=100)
+    thread = threading.Thread(target=chatter)
+    thread.start()
+    assert io.map(work, range(2), group='working', slow=0.05, max_workers=2) == [0, 1]
+    thread.join()
+    assert any('running for' in message for message in io.history)
+
+def test_listen(terminal, tmp_path, monkeypatch):
+    errors = []
+    monkeypatch.setattr(sys, 'excepthook', lambda exception_type, exception, trace: errors.append(exception))
+    address = str(tmp_path / 'status.sock')
+    io, screen = terminal(40, 6)
+    io.listen(address)
+    first = fancyio.RemoteIO(address, terminal=FakeTerminal(40, 6), max_fps=None)
+    first.print('first')
+    assert wait_until(lambda: screen.rows()[0] == '[ ** ] first')
+    second = fancyio.RemoteIO(address, terminal=FakeTerminal(40, 6), max_fps=None)
+    second.print('second')
+    assert wait_until(lambda: screen.rows()[:2] == ['[ ** ] first', '[ ** ] second'])
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as malformed:
+        malformed.connect(address)
+        malformed.sendall(b'garbage\n')
+        assert wait_until(lambda: len(errors) > 0)
+    first._close()
+    assert wait_until(lambda: not io[0].is_running())
+    assert io[1].is_running()
+    second.print('still here')
+    assert wait_until(lambda: screen.rows()[:3] == ['[ ** ] first', '[ ** ] second', '[ ** ] still here'])
+    io._close()
+    assert not os.path.exists(address)
+    second.print('after the listener has gone away')
+    second._close()
+    assert len(errors) == 1
+
+def test_resize_while_stopping_renderer(terminal):
+    def resize():
+        with io._renderer_lock: # held by _stop_renderer, which the signal may interrupt
+            io._on_resize(signal.SIGWINCH, None)
+
+    io, screen = terminal()
+    thread = threading.Thread(target=resize, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert io._renderer is None
+
+def test_scheduler(monkeypatch):
+    errors = []
+    monkeypatch.setattr(sys, 'excepthook', lambda exception_type, exception, trace: errors.append(exception))
+    scheduler = fancyio._Scheduler()
+    calls = []
+    now = time.monotonic()
+    scheduler.call_at(now + 0.1, lambda: calls.append('last'))
+    scheduler.call_at(now + 0.05, lambda: 1 / 0)
+    scheduler.call_at(now, lambda: calls.append('first'))
+    assert wait_until(lambda: scheduler._thread is None) # stops once there are no pending calls
+    assert calls == ['first', 'last']
+    assert len(errors) == 1
+    scheduler.call_at(time.monotonic(), lambda: calls.append('again'))
+    assert wait_until(lambda: calls[-1] == 'again')
+
+def test_sleep_lines(terminal):
+    io, screen = terminal()
+    lines = [fancyio.SleepLine(io, 0.1 * i) for i in range(3)]
+    start = time.monotonic()
+    for line in lines:
+        line.start()
+    for line in lines:
+        line.join()
+    assert time.monotonic() - start >= 0.2
+    assert wait_until(lambda: screen.rows()[:3] == ['[ ok ] sleeping for {} milliseconds'.format(100 * i) for i in range(3)])
+
+def test_line_list_index():
+    lines = [fancyio.Line(None) for _ in range(5)]
+    line_list = fancyio.LineList(lines[:3])
+    line_list.append(lines[3])
+    assert [line_list.index(line) for line in lines[:4]] == [0, 1, 2, 3]
+    line_list.insert(0, lines[4])
+    assert [line_list.index(line) for line in lines] == [1, 2, 3, 4, 0]
+    del line_list[1:3]
+    assert [line_list.index(line) for line in (lines[4], lines[2], lines[3])] == [0, 1, 2]
+    assert lines[0] not in line_list
+    with pytest.raises(ValueError):
+        line_list.index(lines[1])
+    line_list[1:2] = [lines[0], lines[1]]
+    assert line_list == [lines[4], lines[0], lines[1], lines[3]]
+    assert [line_list.index(line) for line in line_list] == [0, 1, 2, 3]
+    line_list.insert(-1, lines[2])
+    assert line_list.index(lines[2]) == 3
+    assert line_list.index(lines[3]) == 4
+
+def test_line_list_methods():
+    lines = [fancyio.Line(None) for _ in range(4)]
+    line_list = fancyio.LineList(lines)
+    assert line_list.pop() is lines[3]
+    line_list.remove(lines[0])
+    assert line_list == lines[1:3]
+    line_list.reverse()
+    assert [line_list.index(line) for line in (lines[2], lines[1])] == [0, 1]
+    line_list.extend([lines[0]])
+    line_list += [lines[3]]
+    assert line_list == [lines[2], lines[1], lines[0], lines[3]]
+    assert line_list.index(lines[3]) == 3
+    line_list.clear()
+    assert len(line_list) == 0
+    assert lines[0] not in line_list
+
+def test_line_list_changed_while_appending():
+    class InterleavedLine(fancyio.Line):
+        def __hash__(self):
+            if len(threads) == 0: # the first time, while it is being appended, remove the first line in another thread, like IO._compact from the renderer thread
+                threads.append(threading.Thread(target=line_list.__delitem__, args=[slice(0, 1)]))
+                threads[0].start()
+                threads[0].join(0.1)
+            return id(self)
+
+    threads = []
+    lines = [fancyio.Line(None) for _ in range(3)]
+    line_list = fancyio.LineList(lines)
+    assert line_list.index(lines[2]) == 2
+    line_list.append(InterleavedLine(None))
+    threads[0].join()
+    assert [line_list.index(line) for line in line_list] == [0, 1, 2]
+
+def test_line_list_interactive():
+    first, second = fancyio.InputLine(None), fancyio.InputLine(None)
+    line_list = fancyio.LineList([fancyio.Line(None), second])
+    line_list.insert(0, first)
+    assert line_list.interactive() == [(0, first), (2, second)]
+    first.submitted = True
+    assert line_list.interactive() == [(2, second)]
+    del line_list[2]
+    assert line_list.interactive() == []
+
+def test_key_decoder():
+    decoder = fancyio._KeyDecoder()
+    assert decoder.feed(b'ab\x1b[Ac\x1bOB\x1bx\r') == ['a', 'b', '\x1b[A', 'c', '\x1bOB', '\x1bx', '\r']
+    assert decoder.flush() == []
+
+def test_key_decoder_split_utf8():
+    decoder = fancyio._KeyDecoder()
+    assert decoder.feed('aé'.encode('utf-8')[:2]) == ['a']
+    assert decoder.feed('é日'.encode('utf-8')[1:]) == ['é', '日']
+
+def test_key_decoder_split_escape_sequence():
+    decoder = fancyio._KeyDecoder()
+    assert decoder.feed(b'a\x1b[') == ['a']
+    assert decoder.pending
+    assert decoder.feed(b'3~') == ['\x1b[3~']
+    assert not decoder.pending
+
+def test_key_decoder_lone_escape():
+    decoder = fancyio._KeyDecoder()
+    assert decoder.feed(b'\x1b') == []
+    assert decoder.pending
+    assert decoder.flush() == ['\x1b']
+    assert decoder.feed(b'a') == ['a']
+
+@pytest.mark.parametrize('split', range(1, 20))
+def test_key_decoder_split_paste(split):
+    data = b'\x1b[200~{"a": 1}\x1b[201~x'
+    decoder = fancyio._KeyDecoder()
+    keys = decoder.feed(data[:split]) + decoder.feed(data[split:])
+    assert keys == ['{"a": 1}', 'x']
+    assert isinstance(keys[0], fancyio._Paste)
+    assert not decoder.pending
+
+def test_key_decoder_paste_in_chunks():
+    decoder = fancyio._KeyDecoder()
+    assert decoder.feed(b'\x1b[200~' + b'x' * 10) == []
+    assert not decoder.pending # escape sequences inside pastes are not keys
+    assert decoder.feed(b'\x1b[Ay' * 3) == []
+    assert decoder.feed(b'\x1b[201~') == ['x' * 10 + '\x1b[Ay' * 3]
+
+def test_width():
+    assert fancyio._width('abc') == 3
+    assert fancyio._width('日本') == 4
+    assert fancyio._width('é') == 1 # combining accent
+    assert fancyio._width('\x1b[1mbold\x1b[m') == 4
+
+def test_head_skip_tail():
+    assert fancyio._head('abcdef', 3) == 'abc'
+    assert fancyio._head('日本語', 3) == '日 ' # the cut wide character is replaced with a space
+    assert fancyio._head('\x1b[1m日本\x1b[m', 4) == '\x1b[1m日本\x1b[m'
+    assert fancyio._skip('abcdef', 2) == 'cdef'
+    assert fancyio._skip('日本語', 1) == ' 本語'
+    assert fancyio._skip('日本語', 2) == '本語'
+    assert fancyio._tail('abcdef', 2) == 'ef'
+    assert fancyio._tail('日本語', 3) == ' 語'
+    for text in ('abcdef', '日本語', 'a日b本c'):
+        for width in range(fancyio._width(text) + 1):
+            assert fancyio._width(fancyio._head(text, width)) == width
+            assert fancyio._width(fancyio._skip(text, width)) == fancyio._width(text) - width
+            assert fancyio._width(fancyio._tail(text, width)) == width
+
+def test_layout():
+    assert fancyio._layout('abcde', 2) == (('ab', 2), ('cd', 2), ('e', 1))
+    assert fancyio._layout('', 2) == (('', 0),)
+    assert fancyio._layout('日本語', 3) == (('日', 2), ('本', 2), ('語', 2))
+    assert fancyio._layout('\x1b[1mabcd\x1b[m', 2) == (('\x1b[1mab\x1b[m', 2), ('\x1b[1mcd\x1b[m', 2)) # formatting is repeated on each row
+
+def test_wrapped_lines(terminal):
+    io, screen = terminal(12, 6)
+    io.print('a' * 8 + '日本語', wrap=True)
+    fancyio.StringLine(io, '日本語' * 3, wrap=True)
+    io.print('cut off ' * 2)
+    io.update()
+    assert screen.rows() == [
+        '[ ** ] aaaaa',
+        '       aaa日',
+        '       本語',
+        '日本語日本語',
+        '日本語',
+        '[ ** ] cu...'
+    ]
+
+def test_parse_row():
+    terminal_io = fancyio.IO(FakeTerminal(), stream=io.StringIO(), mode='terminal')
+    move_x, clear_eol = terminal_io.move_x, terminal_io.caps['clear_eol']
+    assert terminal_io._parse_row(move_x(0) + 'a\x1b[1m日e\u0301\x1b[m' + clear_eol + move_x(3)) == (
+        (('', 'a', 1), ('\x1b[1m', '日', 2), ('\x1b[1m', 'e\u0301', 1)),
+        True,
+        3
+    )
+    assert terminal_io._parse_row('ab') is None # doesn't start in the first column
+    assert terminal_io._parse_row(move_x(0) + 'a\x1b[Hb') is None # moves the cursor
+    assert terminal_io._parse_row(move_x(0) + 'a\nb') is None
+
+def test_diff():
+    terminal_io = fancyio.IO(FakeTerminal(), stream=io.StringIO(), mode='terminal')
+    move_x, clear_eol = terminal_io.move_x, terminal_io.caps['clear_eol']
+    row = move_x(0) + '[=...] task' + clear_eol
+    assert terminal_io._diff(0, row) == row # nothing known about the row yet
+    assert terminal_io._diff(0, row) == ''
+    assert terminal_io._diff(0, move_x(0) + '[==..] task' + clear_eol) == move_x(2) + '='
+    assert terminal_io._diff(0, move_x(0) + '[==..] ta' + clear_eol) == move_x(9) + clear_eol
+    assert terminal_io._diff(0, move_x(0) + '[==..] \x1b[1mta\x1b[m' + clear_eol) == move_x(7) + '\x1b[1mta\x1b[m'
+    assert terminal_io._diff(1, 'unparsed') == 'unparsed'
+
+@pytest.mark.parametrize('seed', range(8))
+def test_diff_matches_full_redraw(terminal, seed):
+    """Applies the same random changes to an IO which only writes what has changed in each row and one which always writes whole rows, and compares what ends up on screen.
+    """
+    def cells(screen):
+        return [[(screen.screen.buffer[y][x].data, screen.screen.buffer[y][x].bold, screen.screen.buffer[y][x].fg) for x in range(30)] for y in range(8)]
+
+    # the accent is precomposed, since pyte wraps a combining character which follows the last column, unlike real terminals
+    words = ['ok', '日本', '\xe9', 'progress', 'x' * 12, '\x1b[1mbold\x1b[m', '\x1b[31mred\x1b[m tail']
+    diffing, diffing_screen = terminal(30, 8)
+    full, full_screen = terminal(30, 8)
+    full._parse_row = lambda text: None
+    steps = random.Random(seed)
+    for step in range(300):
+        operation = steps.random()
+        choice_seed = steps.random()
+        for io in (diffing, full):
+            choices = random.Random(choice_seed)
+            text = ' '.join(choices.choice(words) for _ in range(choices.randint(0, 6)))
+            with io.update_lock:
+                if operation < 0.25 or len(io) == 0:
+                    fancyio.PrefixLine(io, text, prefix=choices.choice(['**', 'ok', '....']), wrap=choices.random() < 0.3)
+                elif operation < 0.75:
+                    line = io[choices.randrange(len(io))]
+                    if choices.random() < 0.5:
+                        line.message = text
+                    else:
+                        line.prefix = choices.choice(['....', '=...', '==..', ' ok ', 'FAIL'])
+                elif operation < 0.85:
+                    index = choices.randrange(len(io))
+                    if io._row(index) >= io.max_lines - io.height:
+                        del io[index]
+                else:
+                    io.insert(choices.randrange(len(io)), fancyio.StringLine(None, text))
+            io.update()
+        assert cells(diffing_screen) == cells(full_screen), step
+        assert diffing_screen.screen.cursor.y == full_screen.screen.cursor.y
+    assert sum(map(len, diffing_screen.written)) < sum(map(len, full_screen.written))